@@ -1,10 +1,24 @@
 import os
+import atexit
+import csv
+import io
+import errno
+import hashlib
 import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 from flask_cors import CORS
 from datetime import datetime
+from functools import lru_cache
 import re
+import sqlite3
+import orjson
 import requests
 from dotenv import load_dotenv
 
@@ -13,8 +27,59 @@ from langfuse_tracer import get_tracer, initialize_tracing
 # Load environment variables
 load_dotenv()
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes responses and parses requests with orjson"""
+
+    # Mirror Flask's DefaultJSONProvider defaults
+    sort_keys = True
+    compact = None
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as a JSON string"""
+        return orjson.dumps(obj, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize data from a JSON string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serialize the given arguments as JSON and return a Response"""
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._options()
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, option=option), mimetype="application/json"
+        )
+
+    def _options(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Skip key sorting and pretty-printing - responses are consumed by the frontend
+app.json.sort_keys = False
+app.json.compact = True
 CORS(app)
+# Compress JSON bodies - progress responses repeat the same row keys over
+# thousands of rows and shrink by an order of magnitude. Streamed NDJSON
+# responses are left alone, since compressing them buffers the stream.
+app.config.update(
+    COMPRESS_MIMETYPES=["application/json"],
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_STREAMS=False,
+    COMPRESS_LEVEL=4,
+)
+Compress(app)
+# ETag suffixes of uncompressed and compressed responses
+_ETAG_ENCODING_SUFFIXES = [""] + [
+    f":{encoding}" for encoding in app.config["COMPRESS_ALGORITHM"]
+]
 
 # Initialize Langfuse tracing
 initialize_tracing()
@@ -24,328 +89,704 @@ tracer = get_tracer()
 # Use host.docker.internal to reach host's Ollama from Docker container
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://host.docker.internal:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+# Batch requests bulk map sends to Ollama at once. Ollama only works on them
+# in parallel if it is started with OLLAMA_NUM_PARALLEL of at least this.
+OLLAMA_MAX_PARALLEL = int(os.getenv("OLLAMA_MAX_PARALLEL", "4"))
+# Transactions per bulk map prompt. Larger batches spread Ollama's fixed
+# per-request cost over more rows; mostly unanswered batches are retried
+# in halves.
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "20"))
+# Context window requested from Ollama. Prompts that don't fit are
+# truncated from the start, dropping the category list and instructions.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+# Rough prompt size estimate, and room left for each row's answer - a JSON
+# item like {"row": 123, "category": "Food & Groceries"}, is ~18 tokens,
+# more for longer category names
+CHARS_PER_TOKEN = 4
+RESPONSE_TOKENS_PER_ROW = 24
+
+# Shared session so concurrent Ollama requests reuse pooled connections
+ollama_session = requests.Session()
+ollama_session.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_maxsize=OLLAMA_MAX_PARALLEL)
+)
+ollama_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_maxsize=OLLAMA_MAX_PARALLEL)
+)
 
 # Configuration
 PROGRESS_FILE = Path(__file__).parent.parent / "mapping_progress.json"
 CATEGORIES_FILE = Path(__file__).parent / "categories.json"
 FILE_MAPPINGS_FILE = Path(__file__).parent.parent / "file_mappings.json"
+# Append-only log of row mappings made since PROGRESS_FILE was last written
+PROGRESS_LOG_FILE = Path(__file__).parent.parent / "mapping_progress.log"
+# LLM suggestions for recurring merchants, kept across restarts
+LLM_CACHE_FILE = Path(__file__).parent.parent / "llm_cache.db"
+# Fold the log back into PROGRESS_FILE once it grows past this size
+PROGRESS_LOG_MAX_BYTES = 1024 * 1024
+
+# Category names as a frozenset, plus their case-folded forms, keyed on
+# CATEGORIES_FILE's mtime
+_category_set_cache = {"mtime": None, "names": frozenset(), "folded": frozenset()}
+# Encoded /api/categories body and its ETag, keyed on CATEGORIES_FILE's mtime
+_categories_response_cache = {"mtime": None, "entry": None}
+# (key, entry) for single suggestions: the examples and system prompt, keyed
+# on the progress ETag and the categories fingerprint. Replaced as one tuple,
+# so concurrent requests never pair one key with another request's entry
+_suggestion_context_cache = {"cached": None}
+
+# Saves arriving within this many seconds of the last write are coalesced
+PROGRESS_SAVE_INTERVAL = 0.5
+FILE_MAPPINGS_SAVE_INTERVAL = 0.5
+# Rows encoded per chunk by the streaming progress endpoint
+PROGRESS_STREAM_CHUNK_ROWS = 500
+# Rows serialized per chunk when hashing an uploaded file
+FILE_HASH_CHUNK_ROWS = 1000
+
+# Previous categorizations included in each prompt
+MAX_PROMPT_EXAMPLES = 100
+
+# Category suggestions for recurring merchants - LLM answers, overwritten by
+# the user's own mappings - least recently used first:
+# (normalized description, amount sign, categories fingerprint) -> category
+SUGGESTION_CACHE_SIZE = 10000
+_suggestion_cache = OrderedDict()
+# Most recently written suggestions kept in LLM_CACHE_FILE
+LLM_CACHE_MAX_ROWS = 50000
+# Guards _suggestion_cache and the LLM_CACHE_FILE connection
+_suggestion_cache_lock = threading.Lock()
+# Connection to LLM_CACHE_FILE, opened on first use, and the categories
+# fingerprint its rows were last pruned to
+_suggestion_db = {"conn": None, "categories": None}
+# Store numbers and reference codes vary between charges from the same
+# merchant, so digits and punctuation are dropped from cache keys
+_DESCRIPTION_NOISE_RE = re.compile(r"[\W\d_]+")
+# Characters not allowed in category names (anything but letters, digits,
+# spaces, &, - and /)
+_CATEGORY_INVALID_CHARS_RE = re.compile(r"[^a-zA-Z0-9\s&\-/]")
+
+# Parsed JSON state files: path -> (mtime_ns, data)
+_json_file_cache = {}
+# Serializes changes to the shared file mappings dict and their saves
+_file_mappings_lock = threading.RLock()
+# Time of the last file mappings write, the pending deferred write, if any,
+# and the mappings it will write
+_file_mappings_writer = {"last_write": 0.0, "timer": None, "data": None}
+
+# Progress (snapshot + replayed log). Read from disk on first use; after
+# that the in-memory copy is authoritative and the files only receive writes.
+_progress_cache = {"data": None}
+# Guards _progress_cache and the progress files against the deferred writer
+_progress_lock = threading.RLock()
+# Time of the last snapshot write and the pending deferred write, if any
+_progress_writer = {"last_write": 0.0, "timer": None}
+
+
+def _cached_json(path, default):
+    """
+    Parse a JSON file, reusing the previous result until its mtime changes.
+
+    Returns default() if the file doesn't exist. The parsed data is shared
+    between callers.
+    """
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return default()
+
+    cached = _json_file_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        data = orjson.loads(f.read())
+    _json_file_cache[path] = (mtime, data)
+    return data
+
+
+def _store_json(path, data):
+    """Write data to a JSON file and keep it as the cached parse of that file"""
+    # Indented - these files are meant to be readable and hand-editable
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    # mtime resolution is too coarse to notice back-to-back saves, so the
+    # cache is refreshed here rather than left to the mtime check
+    _json_file_cache[path] = (path.stat().st_mtime_ns, data)
 
 
 def load_categories():
     """Load categories from file"""
-    if CATEGORIES_FILE.exists():
-        with open(CATEGORIES_FILE, "r") as f:
-            return json.load(f)
-    return []
+    # Copied because callers sort and extend the list
+    return list(_cached_json(CATEGORIES_FILE, list))
 
 
 def save_categories(categories):
     """Save categories to file"""
-    with open(CATEGORIES_FILE, "w") as f:
-        json.dump(categories, f, indent=2)
+    _store_json(CATEGORIES_FILE, list(categories))
+    _category_set_cache["mtime"] = None
+    _categories_response_cache["entry"] = None
+
+
+def load_category_set():
+    """Load categories as a frozenset for constant-time membership checks"""
+    try:
+        mtime = CATEGORIES_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+
+    if mtime != _category_set_cache["mtime"]:
+        names = frozenset(load_categories())
+        _category_set_cache["names"] = names
+        _category_set_cache["folded"] = frozenset(name.casefold() for name in names)
+        _category_set_cache["mtime"] = mtime
+    return _category_set_cache["names"]
+
+
+def category_exists(name):
+    """Check whether a category name is already taken, ignoring case"""
+    load_category_set()
+    return name.casefold() in _category_set_cache["folded"]
 
 
 def load_file_mappings():
-    """Load file mappings history"""
-    if FILE_MAPPINGS_FILE.exists():
-        with open(FILE_MAPPINGS_FILE, "r") as f:
-            return json.load(f)
-    return {"mappings": {}}
+    """
+    Load file mappings history.
+
+    The returned dict is shared between requests; change it while holding
+    _file_mappings_lock and persist the change with save_file_mappings().
+    """
+    return _cached_json(FILE_MAPPINGS_FILE, lambda: {"mappings": {}})
+
+
+def _write_file_mappings():
+    """Write the pending file mappings to FILE_MAPPINGS_FILE"""
+    with _file_mappings_lock:
+        _file_mappings_writer["timer"] = None
+        _store_json(FILE_MAPPINGS_FILE, _file_mappings_writer["data"])
+        _file_mappings_writer["last_write"] = time.monotonic()
 
 
 def save_file_mappings(mappings):
-    """Save file mappings to file"""
-    with open(FILE_MAPPINGS_FILE, "w") as f:
-        json.dump(mappings, f, indent=2)
+    """
+    Save file mappings to file.
+
+    Saves arriving within FILE_MAPPINGS_SAVE_INTERVAL of the previous write
+    are coalesced into a single deferred write, so mapping rows one click
+    at a time doesn't rewrite the whole history for every click. Until it
+    runs, load_file_mappings() keeps returning the updated shared dict.
+    """
+    with _file_mappings_lock:
+        _file_mappings_writer["data"] = mappings
+        if _file_mappings_writer["timer"] is not None:
+            return
+
+        delay = FILE_MAPPINGS_SAVE_INTERVAL - (
+            time.monotonic() - _file_mappings_writer["last_write"]
+        )
+        # Without the file, load_file_mappings() can't return the cached dict
+        if delay > 0 and FILE_MAPPINGS_FILE.exists():
+            timer = threading.Timer(delay, _write_file_mappings)
+            _file_mappings_writer["timer"] = timer
+            timer.start()
+        else:
+            _write_file_mappings()
 
 
 def get_file_mapping_hash(rows):
     """Create a hash of file contents to detect changes"""
-    import hashlib
+    # Hash the bytes of json.dumps(rows, sort_keys=True) one row at a time,
+    # so hashes already stored in file_mappings.json still match without
+    # building the whole document in memory. This stays on the json module:
+    # orjson's output differs (no spaces, no ASCII escaping), which would
+    # change every hash.
+    digest = hashlib.sha256(b"[")
+    for start in range(0, len(rows), FILE_HASH_CHUNK_ROWS):
+        if start:
+            digest.update(b", ")
+        # Encode a chunk as a JSON array and drop its brackets
+        chunk = json.dumps(rows[start : start + FILE_HASH_CHUNK_ROWS], sort_keys=True)
+        digest.update(chunk[1:-1].encode())
+    digest.update(b"]")
+    return digest.hexdigest()
+
+
+def categories_fingerprint(categories):
+    """Short digest of a category list, so cached suggestions expire when it changes"""
+    return hashlib.blake2b("\n".join(categories).encode(), digest_size=8).hexdigest()
+
+
+def normalize_description(description):
+    """Lowercase a transaction description and drop digits and punctuation"""
+    return _DESCRIPTION_NOISE_RE.sub(" ", str(description or "").lower()).strip()
+
+
+def suggestion_cache_key(transaction_data, categories_digest):
+    """
+    Build the suggestion cache key for a transaction.
+
+    Returns None when the description has nothing left to key on after
+    normalization, in which case the transaction is never cached.
+    """
+    description = normalize_description(transaction_data.get("Description"))
+    if not description:
+        return None
+
+    try:
+        sign = "-" if float(transaction_data.get("Amount")) < 0 else "+"
+    except (TypeError, ValueError):
+        sign = "?"
+    return (description, sign, categories_digest)
+
+
+def _open_suggestion_db():
+    """Return the LLM_CACHE_FILE connection (call with _suggestion_cache_lock held)"""
+    if _suggestion_db["conn"] is None:
+        conn = sqlite3.connect(LLM_CACHE_FILE, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS suggestions ("
+            "description TEXT, sign TEXT, categories TEXT, category TEXT, "
+            "PRIMARY KEY (description, sign, categories))"
+        )
+        _suggestion_db["conn"] = conn
+    return _suggestion_db["conn"]
+
+
+def _remember_suggestion(cache_key, suggestion):
+    """Add an entry to the in-memory LRU (call with _suggestion_cache_lock held)"""
+    _suggestion_cache[cache_key] = suggestion
+    _suggestion_cache.move_to_end(cache_key)
+    if len(_suggestion_cache) > SUGGESTION_CACHE_SIZE:
+        _suggestion_cache.popitem(last=False)
+
+
+def get_cached_suggestion(cache_key):
+    """
+    Return the cached category for a key, or None.
+
+    Keys missing from the in-memory LRU are looked up in LLM_CACHE_FILE,
+    so merchants categorized before a restart still skip the LLM.
+    """
+    if cache_key is None:
+        return None
+    with _suggestion_cache_lock:
+        suggestion = _suggestion_cache.get(cache_key)
+        if suggestion is not None:
+            _suggestion_cache.move_to_end(cache_key)
+            return suggestion
+
+        try:
+            row = (
+                _open_suggestion_db()
+                .execute(
+                    "SELECT category FROM suggestions "
+                    "WHERE description = ? AND sign = ? AND categories = ?",
+                    cache_key,
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to read LLM cache: {e}", flush=True)
+            return None
+        if row is None:
+            return None
+        _remember_suggestion(cache_key, row[0])
+        return row[0]
+
+
+def cache_suggestion(cache_key, suggestion):
+    """
+    Remember a validated suggestion in memory and in LLM_CACHE_FILE.
+
+    Rows keyed to an older category list can never be hit again, so they
+    are dropped on the first write for a new list. Beyond that the file
+    keeps the LLM_CACHE_MAX_ROWS most recently written suggestions.
+    """
+    if cache_key is None:
+        return
+    with _suggestion_cache_lock:
+        _remember_suggestion(cache_key, suggestion)
+        try:
+            conn = _open_suggestion_db()
+            with conn:
+                if _suggestion_db["categories"] != cache_key[2]:
+                    conn.execute(
+                        "DELETE FROM suggestions WHERE categories != ?",
+                        (cache_key[2],),
+                    )
+                    _suggestion_db["categories"] = cache_key[2]
+                # REPLACE assigns a new, highest rowid, so rowids follow
+                # write order
+                conn.execute(
+                    "INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?, ?)",
+                    (*cache_key, suggestion),
+                )
+                conn.execute(
+                    "DELETE FROM suggestions WHERE rowid <= "
+                    "(SELECT MAX(rowid) FROM suggestions) - ?",
+                    (LLM_CACHE_MAX_ROWS,),
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to write LLM cache: {e}", flush=True)
+
+
+def build_category_lookup(categories):
+    """
+    Map category names to their canonical spelling for validating LLM output.
+
+    Exact names map to themselves and take precedence; otherwise the
+    lowercase form maps to the first category with that spelling.
+    """
+    lookup = {}
+    for cat in categories:
+        lookup.setdefault(cat.lower(), cat)
+    for cat in categories:
+        lookup[cat] = cat
+    return lookup
+
+
+def match_category(suggestion, category_lookup):
+    """Return the category a suggestion names (case-insensitively), or None"""
+    return category_lookup.get(suggestion) or category_lookup.get(suggestion.lower())
 
-    # Use the sorted row data to create a hash
-    content = json.dumps(rows, sort_keys=True)
-    return hashlib.sha256(content.encode()).hexdigest()
+
+def mapping_example(transaction_data, category):
+    """Build a {date, amount, description, category} prompt example"""
+    return {
+        "date": transaction_data.get(
+            "Date", transaction_data.get("Transaction Date", "")
+        ),
+        "amount": transaction_data.get("Amount", ""),
+        "description": transaction_data.get("Description", ""),
+        "category": category,
+    }
 
 
-def build_llm_prompt(transaction_data, categories, previous_mappings):
+def recent_mapping_examples(rows, limit=MAX_PROMPT_EXAMPLES):
     """
-    Build a prompt for the LLM to suggest a category.
+    Collect prompt examples from the mapped progress rows.
+
+    Repeated examples of the same merchant and category are dropped,
+    keeping the latest row of each (normalized description, category)
+    pair, so the examples cover as many distinct merchants as possible.
+    Rows are walked from the end and the walk stops once `limit` examples
+    are found, since the prompt never uses more than that.
+
+    Args:
+        rows: Progress rows list
+        limit: Maximum number of examples to return
+
+    Returns:
+        Examples in row order, most recent last
+    """
+    examples = {}
+    for row_data in reversed(rows):
+        category = row_data.get("category")
+        if not row_data.get("mapped") or not category:
+            continue
+        transaction_data = row_data["data"]
+        key = (
+            normalize_description(transaction_data.get("Description", "")),
+            category,
+        )
+        if key in examples:
+            continue
+        examples[key] = mapping_example(transaction_data, category)
+        if len(examples) >= limit:
+            break
+    return list(examples.values())[::-1]
+
+
+def format_examples(previous_mappings):
+    """
+    Format the previous mappings section of the prompt.
 
     Args:
-        transaction_data: Dict with transaction details (Date, Amount, Description, etc.)
-        categories: List of available budget categories
         previous_mappings: List of {date, amount, description, category} examples
 
     Returns:
-        Prompt string for the LLM
+        Examples block for the prompt (up to MAX_PROMPT_EXAMPLES most recent),
+        or "" if none
     """
-    # Build examples from previous mappings (up to 100 most recent)
-    examples = ""
-    if previous_mappings:
-        examples = "\nHere are examples of previous categorizations:\n"
-        # Use up to 100 examples
-        for mapping in previous_mappings[-100:]:
-            date = mapping.get("date", "N/A")
-            amount = mapping.get("amount", "N/A")
-            description = mapping.get("description", "")
-            category = mapping.get("category", "N/A")
-            examples += f'- Date: {date} | Amount: {amount} | Description: "{description}" → {category}\n'
+    if not previous_mappings:
+        return ""
+
+    lines = ["\nHere are examples of previous categorizations:\n"]
+    for mapping in previous_mappings[-MAX_PROMPT_EXAMPLES:]:
+        date = mapping.get("date", "N/A")
+        amount = mapping.get("amount", "N/A")
+        description = mapping.get("description", "")
+        category = mapping.get("category", "N/A")
+        lines.append(
+            f'- Date: {date} | Amount: {amount} | Description: "{description}" → {category}\n'
+        )
+    return "".join(lines)
 
-    # Build categories list
-    categories_str = ", ".join(categories)
 
-    # Build the full prompt
-    prompt = f"""You are a budget categorization assistant. Based on transaction details, suggest the most appropriate budget category.
+def build_batch_system_prompt(categories, previous_mappings):
+    """
+    Build the system message of the categorization prompt.
 
-Available Categories: {categories_str}
+    It holds everything that is the same for every batch - the categories
+    and the previous categorization examples - so Ollama can reuse its
+    cached prefill of this prefix from one batch to the next. bulk_map
+    builds it once per run.
 
-{examples}
+    Args:
+        categories: List of available budget categories
+        previous_mappings: List of {date, amount, description, category} examples
 
-Current Transaction to Categorize:
-- Date: {transaction_data.get("Date", "N/A")}
-- Amount: {transaction_data.get("Amount", "N/A")}
-- Description: {transaction_data.get("Description", "N/A")}
+    Returns:
+        System prompt string for the LLM
+    """
+    # Build categories list
+    categories_str = ", ".join(categories)
 
-Based on the description, amount, and available categories, respond with ONLY the category name that best matches this transaction. Do not include any explanation, just the category name.
+    examples = format_examples(previous_mappings)
 
-Category: """
+    return f"""You are a budget categorization assistant. Based on transaction details, suggest the most appropriate budget category for each transaction.
 
-    return prompt
+Available Categories: {categories_str}
+{examples}"""
 
 
-def build_batch_llm_prompt(transaction_batch, categories, previous_mappings):
+def build_batch_llm_prompt(
+    transaction_batch, categories, previous_mappings, system_prompt=None
+):
     """
-    Build a prompt for batch categorization (up to 5 transactions at a time).
+    Build a prompt for batch categorization (up to LLM_BATCH_SIZE transactions).
 
     Args:
-        transaction_batch: List of tuples (idx, transaction_data) for up to 5 transactions
+        transaction_batch: List of tuples (idx, transaction_data) to categorize
         categories: List of available budget categories
         previous_mappings: List of {date, amount, description, category} examples
+        system_prompt: Optional result of
+            build_batch_system_prompt(categories, previous_mappings)
 
     Returns:
-        Prompt string for the LLM with structured batch output format
+        (system_prompt, user_prompt) tuple; the user prompt holds the
+        transactions and the structured batch output format
     """
-    # Build examples from previous mappings (up to 100 most recent)
-    examples = ""
-    if previous_mappings:
-        examples = "\nHere are examples of previous categorizations:\n"
-        # Use up to 100 examples
-        for mapping in previous_mappings[-100:]:
-            date = mapping.get("date", "N/A")
-            amount = mapping.get("amount", "N/A")
-            description = mapping.get("description", "")
-            category = mapping.get("category", "N/A")
-            examples += f'- Date: {date} | Amount: {amount} | Description: "{description}" → {category}\n'
-
-    # Build categories list
-    categories_str = ", ".join(categories)
+    if system_prompt is None:
+        system_prompt = build_batch_system_prompt(categories, previous_mappings)
 
     # Build transactions list with row indices
-    transactions_str = ""
+    transaction_lines = []
     for idx, transaction_data in transaction_batch:
         date = transaction_data.get(
             "Date", transaction_data.get("Transaction Date", "N/A")
         )
         amount = transaction_data.get("Amount", "N/A")
         description = transaction_data.get("Description", "N/A")
-        transactions_str += f'Row {idx}: Date: {date} | Amount: {amount} | Description: "{description}"\n'
-
-    # Build the full prompt for batch processing
-    prompt = f"""You are a budget categorization assistant. Based on transaction details, suggest the most appropriate budget category for each transaction.
-
-Available Categories: {categories_str}
+        transaction_lines.append(
+            f'Row {idx}: Date: {date} | Amount: {amount} | Description: "{description}"\n'
+        )
+    transactions_str = "".join(transaction_lines)
 
-{examples}
+    # Show the expected output format using the first rows of the batch,
+    # which may hold a single row
+    format_example = ", ".join(
+        f'{{"row": {idx}, "category": "<CATEGORY_NAME>"}}'
+        for idx, _ in transaction_batch[:2]
+    )
 
-Transactions to Categorize (batch processing):
+    # Build the per-batch part of the prompt
+    user_prompt = f"""Transactions to Categorize (batch processing):
 {transactions_str}
 
-For each transaction above, provide the category in the following format:
-Row {transaction_batch[0][0]}: <CATEGORY_NAME>
-Row {transaction_batch[1][0]}: <CATEGORY_NAME>
-...(continue for each row)
+For each transaction above, provide the category as JSON in the following format:
+{{"mappings": [{format_example}, ...(continue for each row)]}}
 
 Rules:
-- Respond with ONLY the row and category mapping
+- Respond with ONLY the JSON object
 - Do not include any explanation
-- Each line must be in the format: Row <number>: <CATEGORY_NAME>
+- "row" is the transaction's row number
 - Use the exact category names from the available list
-- Process all transactions
+- Process all transactions"""
 
-Categories: """
+    return system_prompt, user_prompt
 
-    return prompt
 
-
-def get_llm_suggestion(transaction_data, categories, previous_mappings, trace=None):
+def batch_response_format(categories):
     """
-    Get a category suggestion from Ollama/Llama 3.1.
-
-    Args:
-        transaction_data: Dict with transaction details
-        categories: List of available budget categories
-        previous_mappings: List of previous categorizations for context
-        trace: Optional Langfuse trace object for monitoring
+    Build the JSON schema Ollama constrains batch responses to.
 
-    Returns:
-        Dict with suggested category and confidence
+    Categories are an enum, so the model can only emit valid category names
+    and decoding stops after each name instead of running on.
     """
-    try:
-        prompt = build_llm_prompt(transaction_data, categories, previous_mappings)
-
-        # Add span for prompt building
-        if trace:
-            tracer.add_span(
-                trace,
-                name="build_prompt",
-                output_text=f"Prompt built ({len(prompt)} chars)",
-                metadata={"prompt_length": len(prompt)},
-            )
-
-        response = requests.post(
-            f"{OLLAMA_API_URL}/api/generate",
-            json={
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "temperature": 0.3,  # Lower temperature for more consistent results
-            },
-            timeout=30,
-        )
-
-        if response.status_code != 200:
-            if trace:
-                tracer.add_span(
-                    trace,
-                    name="ollama_error",
-                    input_text=f"Status {response.status_code}",
-                    metadata={"error": True, "status_code": response.status_code},
-                )
-            return {
-                "success": False,
-                "error": f"Ollama API error: {response.status_code}",
-                "suggestion": None,
+    return {
+        "type": "object",
+        "properties": {
+            "mappings": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "row": {"type": "integer"},
+                        "category": {"type": "string", "enum": list(categories)},
+                    },
+                    "required": ["row", "category"],
+                },
             }
+        },
+        "required": ["mappings"],
+    }
 
-        response_data = response.json()
-        response_text = response_data.get("response", "").strip()
 
-        # Log the LLM generation
-        if trace:
-            tracer.add_generation(
-                trace,
-                name="ollama_categorization",
-                model=OLLAMA_MODEL,
-                input_text=prompt,
-                output_text=response_text,
-                usage={
-                    "prompt_tokens": response_data.get("prompt_eval_count", 0),
-                    "completion_tokens": response_data.get("eval_count", 0),
-                },
-                metadata={
-                    "temperature": 0.3,
-                    "ollama_host": OLLAMA_API_URL,
-                    "transaction_description": transaction_data.get("Description", ""),
-                },
-            )
+def parse_batch_response(response_text, category_lookup, batch_rows):
+    """
+    Parse a batch response into {row index: category}.
 
-        # Clean up the response - remove extra whitespace and quotes
-        suggestion = response_text.strip().strip("\"'")
+    Only items whose row is an integer naming one of batch_rows are kept,
+    so a malformed item (e.g. "row": true or 1.9) can't claim another row.
+    Rows whose category isn't one of the available categories map to None.
+    A response that isn't the requested JSON object parses as no rows.
+    """
+    try:
+        mappings = orjson.loads(response_text).get("mappings")
+    except (orjson.JSONDecodeError, AttributeError):
+        return {}
+
+    parsed_suggestions = {}
+    for mapping in mappings if isinstance(mappings, list) else ():
+        if not isinstance(mapping, dict):
+            continue
+        row_idx = mapping.get("row")
+        suggestion = mapping.get("category")
+        # bool is a subclass of int, but true/false never name a row
+        if (
+            not isinstance(row_idx, int)
+            or isinstance(row_idx, bool)
+            or row_idx not in batch_rows
+            or not isinstance(suggestion, str)
+        ):
+            continue
+        # Validate category (case-insensitive); None marks it invalid
+        parsed_suggestions[row_idx] = match_category(
+            suggestion.strip(), category_lookup
+        )
+    return parsed_suggestions
 
-        # Validate that suggestion is one of the available categories
-        if suggestion not in categories:
-            # Try to find a close match (case-insensitive)
-            for cat in categories:
-                if cat.lower() == suggestion.lower():
-                    suggestion = cat
-                    break
-            else:
-                # No match found, return error
-                if trace:
-                    tracer.add_span(
-                        trace,
-                        name="validation_error",
-                        input_text=f"Invalid category: {suggestion}",
-                        output_text="Validation failed",
-                        metadata={"error": True, "suggested": suggestion},
-                    )
-                return {
-                    "success": False,
-                    "error": f"LLM suggested invalid category: {suggestion}",
-                    "suggestion": None,
-                }
 
-        # Log successful categorization
-        if trace:
-            tracer.add_span(
-                trace,
-                name="validation_success",
-                input_text=f"Validated category: {suggestion}",
-                output_text="Validation passed",
-                metadata={"category": suggestion},
-            )
+def suggestion_context(progress_data, categories):
+    """
+    Return (previous_mappings, system_prompt) for suggesting a single row.
 
-        return {"success": True, "suggestion": suggestion, "error": None}
+    Both only change when a row is mapped or the categories change, so they
+    are reused across suggestions until then, e.g. while the user steps
+    through rows without mapping them.
+    """
+    key = (_progress_etag(progress_data), categories_fingerprint(categories))
+    cached = _suggestion_context_cache["cached"]
+    if cached is not None and cached[0] == key:
+        return cached[1]
 
-    except requests.exceptions.ConnectionError:
-        if trace:
-            tracer.add_span(
-                trace,
-                name="connection_error",
-                input_text="Ollama connection",
-                output_text=f"Failed to connect to {OLLAMA_API_URL}",
-                metadata={"error": True, "error_type": "ConnectionError"},
-            )
-        return {
-            "success": False,
-            "error": "Could not connect to Ollama. Make sure Ollama is running on "
-            + OLLAMA_API_URL,
-            "suggestion": None,
-        }
-    except Exception as e:
-        if trace:
-            tracer.add_span(
-                trace,
-                name="unexpected_error",
-                input_text=type(e).__name__,
-                output_text=str(e),
-                metadata={"error": True, "error_type": type(e).__name__},
-            )
-        return {"success": False, "error": str(e), "suggestion": None}
+    previous_mappings = recent_mapping_examples(progress_data.get("rows") or [])
+    system_prompt = build_batch_system_prompt(categories, previous_mappings)
+    entry = (previous_mappings, system_prompt)
+    _suggestion_context_cache["cached"] = (key, entry)
+    return entry
 
 
 def get_batch_llm_suggestions(
-    transaction_batch, categories, previous_mappings, trace=None
+    transaction_batch,
+    categories,
+    previous_mappings,
+    trace=None,
+    system_prompt=None,
+    retry=True,
 ):
     """
-    Get category suggestions for a batch of transactions (up to 5 at a time).
+    Get category suggestions for a batch of transactions (up to LLM_BATCH_SIZE).
+
+    If fewer than half of the rows get a valid category, the unanswered
+    rows are retried once as two smaller batches; rows still unanswered
+    after that fail.
 
     Args:
-        transaction_batch: List of tuples (idx, transaction_data) for up to 5 transactions
+        transaction_batch: List of tuples (idx, transaction_data) to categorize
         categories: List of available budget categories
         previous_mappings: List of previous categorizations for context
         trace: Optional Langfuse trace object for logging
+        system_prompt: Optional prebuilt
+            build_batch_system_prompt(categories, previous_mappings)
+        retry: Whether mostly unanswered rows may be retried (False for the
+            retries themselves)
 
     Returns:
         Dict with mapping of idx -> {'success': bool, 'suggestion': str or None, 'error': str or None}
     """
     results = {}
 
+    # Answer recurring merchants from the suggestion cache and only send the
+    # rest to Ollama
+    categories_digest = categories_fingerprint(categories)
+    cache_keys = {}
+    uncached_batch = []
+    for idx, transaction_data in transaction_batch:
+        cache_key = suggestion_cache_key(transaction_data, categories_digest)
+        cached_suggestion = get_cached_suggestion(cache_key)
+        if cached_suggestion is not None:
+            results[idx] = {
+                "success": True,
+                "suggestion": cached_suggestion,
+                "error": None,
+            }
+        else:
+            cache_keys[idx] = cache_key
+            uncached_batch.append((idx, transaction_data))
+
+    if not uncached_batch:
+        return results
+    transaction_batch = uncached_batch
+
     try:
-        prompt = build_batch_llm_prompt(
-            transaction_batch, categories, previous_mappings
+        system_prompt, user_prompt = build_batch_llm_prompt(
+            transaction_batch, categories, previous_mappings, system_prompt
         )
+        # Full prompt text, only joined when there is a trace to log it to
+        prompt = f"{system_prompt}\n\n{user_prompt}" if trace else None
 
-        response = requests.post(
-            f"{OLLAMA_API_URL}/api/generate",
+        # Split batches whose prompt and answers won't fit in the context window
+        prompt_chars = len(system_prompt) + len(user_prompt)
+        needed_tokens = prompt_chars // CHARS_PER_TOKEN + RESPONSE_TOKENS_PER_ROW * len(
+            transaction_batch
+        )
+        if len(transaction_batch) > 1 and needed_tokens > OLLAMA_NUM_CTX:
+            half = (len(transaction_batch) + 1) // 2
+            for sub_batch in (transaction_batch[:half], transaction_batch[half:]):
+                results.update(
+                    get_batch_llm_suggestions(
+                        sub_batch,
+                        categories,
+                        previous_mappings,
+                        trace=trace,
+                        system_prompt=system_prompt,
+                        retry=retry,
+                    )
+                )
+            return results
+
+        # The system message is identical across batches, so Ollama reuses
+        # its prefill instead of reprocessing the categories and examples
+        response = ollama_session.post(
+            f"{OLLAMA_API_URL}/api/chat",
             json={
                 "model": OLLAMA_MODEL,
-                "prompt": prompt,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
                 "stream": False,
-                "temperature": 0.3,  # Lower temperature for more consistent results
+                # Constrain the reply to JSON naming only available categories
+                "format": batch_response_format(categories),
+                "options": {
+                    "num_ctx": OLLAMA_NUM_CTX,
+                    # Lower temperature for more consistent results
+                    "temperature": 0.3,
+                },
             },
-            timeout=60,  # Batch processing takes longer (60 seconds for 5 items)
+            # Generation time grows with the number of rows in the batch
+            timeout=60 + 6 * len(transaction_batch),
         )
 
         if response.status_code != 200:
@@ -375,7 +816,8 @@ def get_batch_llm_suggestions(
                 }
             return results
 
-        response_text = response.json().get("response", "").strip()
+        response_data = response.json()
+        response_text = response_data.get("message", {}).get("content", "").strip()
 
         # Log the successful LLM call to Langfuse
         if trace:
@@ -385,6 +827,12 @@ def get_batch_llm_suggestions(
                 model=OLLAMA_MODEL,
                 input_text=prompt,
                 output_text=response_text,
+                # Langfuse's generic usage keys; Ollama reports prompt and
+                # output tokens as prompt_eval_count and eval_count
+                usage={
+                    "input": response_data.get("prompt_eval_count", 0),
+                    "output": response_data.get("eval_count", 0),
+                },
                 metadata={
                     "success": True,
                     "batch_size": len(transaction_batch),
@@ -399,56 +847,52 @@ def get_batch_llm_suggestions(
             flush=True,
         )
 
-        # Parse batch response - expect lines in format: "Row <idx>: <CATEGORY>"
-        lines = response_text.split("\n")
-        parsed_suggestions = {}
-
-        for line in lines:
-            line = line.strip()
-            if not line or not line.startswith("Row"):
-                continue
-
-            try:
-                # Parse "Row <idx>: <CATEGORY>" format
-                parts = line.split(":", 1)
-                if len(parts) != 2:
-                    continue
-
-                row_part = parts[0].strip()  # "Row <idx>"
-                category_part = parts[1].strip()  # "<CATEGORY>"
-
-                # Extract row index
-                row_idx = row_part.replace("Row", "").strip()
-                row_idx = int(row_idx)
-
-                # Clean up category
-                suggestion = category_part.strip().strip("\"'")
-
-                # Validate category
-                if suggestion not in categories:
-                    # Try case-insensitive match
-                    for cat in categories:
-                        if cat.lower() == suggestion.lower():
-                            suggestion = cat
-                            break
-                    else:
-                        # Invalid category, skip this one
-                        parsed_suggestions[row_idx] = None
-                        continue
-
-                parsed_suggestions[row_idx] = suggestion
-            except (ValueError, IndexError):
-                continue
+        # Parse batch response - expect {"mappings": [{"row", "category"}]}
+        parsed_suggestions = parse_batch_response(
+            response_text,
+            build_category_lookup(categories),
+            {idx for idx, _ in transaction_batch},
+        )
 
         # Build results for all items in batch
-        for idx, _ in transaction_batch:
-            if idx in parsed_suggestions and parsed_suggestions[idx]:
+        unanswered = []
+        for idx, transaction_data in transaction_batch:
+            if parsed_suggestions.get(idx):
                 results[idx] = {
                     "success": True,
                     "suggestion": parsed_suggestions[idx],
                     "error": None,
                 }
+                cache_suggestion(cache_keys[idx], parsed_suggestions[idx])
             else:
+                unanswered.append((idx, transaction_data))
+
+        # Long batches occasionally come back mostly unanswered; retry those
+        # rows in two smaller batches rather than failing them outright
+        if (
+            retry
+            and len(transaction_batch) > 1
+            and len(unanswered) * 2 > len(transaction_batch)
+        ):
+            print(
+                f"LLM answered {len(transaction_batch) - len(unanswered)}/{len(transaction_batch)} rows, retrying the rest in smaller batches",
+                flush=True,
+            )
+            half = (len(unanswered) + 1) // 2
+            for retry_batch in (unanswered[:half], unanswered[half:]):
+                if retry_batch:
+                    results.update(
+                        get_batch_llm_suggestions(
+                            retry_batch,
+                            categories,
+                            previous_mappings,
+                            trace=trace,
+                            system_prompt=system_prompt,
+                            retry=False,
+                        )
+                    )
+        else:
+            for idx, _ in unanswered:
                 results[idx] = {
                     "success": False,
                     "error": f"LLM did not provide valid category for row {idx}",
@@ -498,24 +942,17 @@ def validate_and_correct_category(category_name):
         corrections.append(f"Truncated from {len(corrected)} to 50 characters")
         corrected = corrected[:50]
 
-    # Capitalize properly (Title Case)
-    words = corrected.split()
-    capitalized_words = []
-    for word in words:
-        # Handle special cases like "& "
-        if word == "&":
-            capitalized_words.append(word)
-        else:
-            capitalized_words.append(word.capitalize())
-
-    corrected_capitalized = " ".join(capitalized_words)
+    # Capitalize properly (Title Case), leaving "&" as is
+    corrected_capitalized = " ".join(
+        word if word == "&" else word.capitalize() for word in corrected.split()
+    )
 
     if corrected != corrected_capitalized:
         corrections.append(f"Capitalization: '{corrected}' → '{corrected_capitalized}'")
         corrected = corrected_capitalized
 
     # Remove special characters except common ones (spaces, &, -, /)
-    cleaned = re.sub(r"[^a-zA-Z0-9\s&\-/]", "", corrected)
+    cleaned = _CATEGORY_INVALID_CHARS_RE.sub("", corrected)
     if cleaned != corrected:
         corrections.append(f"Removed invalid characters: '{corrected}' → '{cleaned}'")
         corrected = cleaned
@@ -528,6 +965,34 @@ def validate_and_correct_category(category_name):
     }
 
 
+def iter_csv_rows(stream):
+    """
+    Yield each CSV record as a dict keyed by the header row.
+
+    Equivalent to csv.DictReader, but well-formed records are built with a
+    single dict(zip()) instead of DictReader's per-row bookkeeping.
+    Blank lines are skipped; short rows are padded with None and extra
+    fields are collected in a list under the None key, as DictReader does.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    width = len(header)
+
+    for row in reader:
+        if len(row) == width:
+            yield dict(zip(header, row))
+        elif row:
+            record = dict(zip(header, row))
+            if len(row) > width:
+                record[None] = row[width:]
+            else:
+                for key in header[len(row) :]:
+                    record[key] = None
+            yield record
+
+
 def is_row_valid(row):
     """
     Check if a CSV row has the minimum required fields populated.
@@ -543,30 +1008,286 @@ def is_row_valid(row):
     description_field = row.get("Description") or row.get("description")
     amount_field = row.get("Amount") or row.get("amount")
 
-    # Row is valid if all required fields are present and non-empty
-    if not date_field or not str(date_field).strip():
-        return False
-    if not description_field or not str(description_field).strip():
-        return False
-    if not amount_field or not str(amount_field).strip():
-        return False
+    # Row is valid if all required fields are present and non-empty
+    if not date_field or not str(date_field).strip():
+        return False
+    if not description_field or not str(description_field).strip():
+        return False
+    if not amount_field or not str(amount_field).strip():
+        return False
+
+    return True
+
+
+# Accepted column names for each required field, in order of preference
+REQUIRED_FIELD_ALIASES = (
+    ("Date", "Transaction Date", "date"),
+    ("Description", "description"),
+    ("Amount", "amount"),
+)
+
+
+def build_row_validator(fieldnames):
+    """
+    Build an is_row_valid() equivalent for rows that share one header.
+
+    The column names each required field can come from are resolved once
+    against the header, so checking a row only looks at columns that exist.
+
+    Args:
+        fieldnames: Column names of the rows to validate
+
+    Returns:
+        Function taking a row dict and returning whether it is valid
+    """
+    present = set(fieldnames)
+    field_columns = [
+        tuple(name for name in aliases if name in present)
+        for aliases in REQUIRED_FIELD_ALIASES
+    ]
+    if not all(field_columns):
+        # A required field has no column at all, so no row can be valid
+        return lambda row: False
+
+    def row_is_valid(row):
+        for columns in field_columns:
+            value = None
+            for name in columns:
+                value = row[name]
+                if value:
+                    break
+            if not value or not str(value).strip():
+                return False
+        return True
+
+    return row_is_valid
+
+
+def _count_mappings(progress_data):
+    """Recompute the mapped row counters from the rows"""
+    category_counts = Counter(
+        row.get("category") for row in progress_data["rows"] if row.get("mapped")
+    )
+    progress_data["mapped_count"] = sum(category_counts.values())
+    progress_data["category_counts"] = dict(category_counts)
+
+
+def _apply_row_mapping(progress_data, row_idx, category, timestamp):
+    """Mark a progress row as mapped to category, updating the counters"""
+    rows = progress_data["rows"]
+    if not 0 <= row_idx < len(rows):
+        return
+    row = rows[row_idx]
+
+    category_counts = progress_data["category_counts"]
+    if row.get("mapped"):
+        old_category = row.get("category")
+        remaining = category_counts.get(old_category, 0) - 1
+        if remaining > 0:
+            category_counts[old_category] = remaining
+        else:
+            category_counts.pop(old_category, None)
+    else:
+        progress_data["mapped_count"] += 1
+    category_counts[category] = category_counts.get(category, 0) + 1
+
+    row["category"] = category
+    row["mapped"] = True
+    progress_data["last_updated"] = timestamp
+
+
+def _replay_progress_log(progress_data):
+    """Apply row mappings logged since the progress snapshot was written"""
+    if not PROGRESS_LOG_FILE.exists():
+        return
+    with open(PROGRESS_LOG_FILE, "rb") as f:
+        for line in f:
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Partial line left by an interrupted append
+                continue
+            _apply_row_mapping(
+                progress_data, int(entry["row"]), entry["category"], entry["ts"]
+            )
+
+
+def _read_progress_files():
+    """Read the progress snapshot and replay the mapping log on top of it"""
+    if not PROGRESS_FILE.exists():
+        return {
+            "file_name": None,
+            "rows": [],
+            "total_rows": 0,
+            "mapped_count": 0,
+            "category_counts": {},
+            "last_updated": None,
+        }
+
+    with open(PROGRESS_FILE, "rb") as f:
+        progress_data = orjson.loads(f.read())
+    # Progress files written before rows were stored as a list
+    if isinstance(progress_data["rows"], dict):
+        progress_data["rows"] = [
+            row
+            for _, row in sorted(
+                progress_data["rows"].items(), key=lambda item: int(item[0])
+            )
+        ]
+    # Progress files written before the counters were tracked
+    if "mapped_count" not in progress_data:
+        _count_mappings(progress_data)
+    _replay_progress_log(progress_data)
+    return progress_data
+
+
+def load_progress():
+    """
+    Load existing progress.
+
+    The files are only read on the first call; this process is their only
+    writer, so afterwards the in-memory copy is returned directly. The
+    returned dict is shared between requests, so callers that mutate it
+    must persist the change with save_progress() or log_row_mapping().
+    """
+    with _progress_lock:
+        if _progress_cache["data"] is None:
+            _progress_cache["data"] = _read_progress_files()
+        return _progress_cache["data"]
+
+
+def _atomic_write(path, content):
+    """Write bytes to path via a temp file and rename, so readers never see a torn file"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    try:
+        os.replace(tmp_path, path)
+    except OSError as e:
+        if e.errno != errno.EBUSY:
+            raise
+        # Files bind-mounted by docker-compose can't be renamed over
+        os.unlink(tmp_path)
+        with open(path, "wb") as f:
+            f.write(content)
+
+
+def _write_progress_snapshot():
+    """Write the cached progress to PROGRESS_FILE and truncate the mapping log"""
+    with _progress_lock:
+        _progress_writer["timer"] = None
+        # Compact JSON - the file is only read back at startup
+        _atomic_write(PROGRESS_FILE, orjson.dumps(_progress_cache["data"]))
+        # The snapshot now includes every logged row mapping
+        if PROGRESS_LOG_FILE.exists():
+            with open(PROGRESS_LOG_FILE, "wb"):
+                pass
+        _progress_writer["last_write"] = time.monotonic()
+
+
+def save_progress(progress_data, defer=True):
+    """
+    Save progress to file.
+
+    Saves arriving within PROGRESS_SAVE_INTERVAL of the previous write are
+    coalesced into a single deferred write of the latest state. Callers that
+    replace the rows pass defer=False: mapping log entries only make sense
+    on top of the snapshot of the rows they were made for, so that snapshot
+    must be on disk before the next entry is appended.
+    """
+    progress_data["last_updated"] = datetime.now().isoformat()
+    with _progress_lock:
+        _progress_cache["data"] = progress_data
+        if not defer:
+            timer = _progress_writer["timer"]
+            if timer is not None:
+                timer.cancel()
+            _write_progress_snapshot()
+            return
+        if _progress_writer["timer"] is not None:
+            return
+
+        delay = PROGRESS_SAVE_INTERVAL - (
+            time.monotonic() - _progress_writer["last_write"]
+        )
+        if delay > 0:
+            timer = threading.Timer(delay, _write_progress_snapshot)
+            _progress_writer["timer"] = timer
+            timer.start()
+        else:
+            _write_progress_snapshot()
+
+
+def flush_pending_writes():
+    """Write deferred progress and file mapping saves now instead of on their timers"""
+    with _progress_lock:
+        timer = _progress_writer["timer"]
+        if timer is not None:
+            timer.cancel()
+            _write_progress_snapshot()
+    with _file_mappings_lock:
+        timer = _file_mappings_writer["timer"]
+        if timer is not None:
+            timer.cancel()
+            _write_file_mappings()
+
+
+# Don't lose coalesced saves when the server shuts down
+atexit.register(flush_pending_writes)
+
+
+def log_row_mapping(progress_data, row_idx, category):
+    """
+    Map a single row and persist it by appending to the mapping log.
+
+    This avoids rewriting the whole progress file for every mapped row.
+    The log is compacted into the progress file once it exceeds
+    PROGRESS_LOG_MAX_BYTES.
+    """
+    timestamp = datetime.now().isoformat()
+    entry = {"row": row_idx, "category": category, "ts": timestamp}
+
+    with _progress_lock:
+        _apply_row_mapping(progress_data, row_idx, category, timestamp)
+        with open(PROGRESS_LOG_FILE, "ab") as f:
+            f.write(orjson.dumps(entry) + b"\n")
+            log_size = f.tell()
+
+        _progress_cache["data"] = progress_data
+        if log_size > PROGRESS_LOG_MAX_BYTES:
+            save_progress(progress_data)
+
+
+def _progress_etag(progress_data):
+    """
+    Entity tag for responses derived from progress.
 
-    return True
+    last_updated is refreshed by every save and every row mapping, so it
+    identifies the progress state without hashing the rows.
+    """
+    return progress_data.get("last_updated") or "empty"
 
 
-def load_progress():
-    """Load existing progress from file"""
-    if PROGRESS_FILE.exists():
-        with open(PROGRESS_FILE, "r") as f:
-            return json.load(f)
-    return {"file_name": None, "rows": {}, "total_rows": 0, "last_updated": None}
+def _not_modified(etag):
+    """
+    Return an empty 304 response if the client already has etag, else None.
 
+    Flask-Compress appends ":<algorithm>" to the ETag of compressed
+    responses, so the client may hold any of those variants.
+    """
+    for suffix in _ETAG_ENCODING_SUFFIXES:
+        tag = etag + suffix
+        if request.if_none_match.contains(tag):
+            response = app.response_class(status=304)
+            return _with_etag(response, tag)
+    return None
 
-def save_progress(progress_data):
-    """Save progress to file"""
-    progress_data["last_updated"] = datetime.now().isoformat()
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump(progress_data, f, indent=2)
+
+def _with_etag(response, etag):
+    """Tag a response and make clients revalidate it before reuse"""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route("/api/health", methods=["GET"])
@@ -577,18 +1298,70 @@ def health():
 
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
-    """Get list of budget categories"""
-    categories = load_categories()
-    # Sort alphabetically (case-insensitive)
-    categories.sort(key=str.lower)
-    return jsonify({"categories": categories}), 200
+    """
+    Get list of budget categories.
+
+    The encoded body is cached until the categories file changes, so most
+    requests skip loading, sorting and serializing the list.
+    """
+    try:
+        mtime = CATEGORIES_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    entry = _categories_response_cache["entry"]
+    if entry is None or mtime != _categories_response_cache["mtime"]:
+        categories = load_categories()
+        # Sort alphabetically (case-insensitive)
+        categories.sort(key=str.lower)
+        body = orjson.dumps({"categories": categories})
+        entry = (body, hashlib.sha1(body).hexdigest())
+        _categories_response_cache["entry"] = entry
+        _categories_response_cache["mtime"] = mtime
+
+    body, etag = entry
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _with_etag(Response(body, mimetype="application/json"), etag)
 
 
 @app.route("/api/progress", methods=["GET"])
 def get_progress():
     """Get current progress"""
     progress = load_progress()
-    return jsonify(progress), 200
+    etag = _progress_etag(progress)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _with_etag(jsonify(progress), etag), 200
+
+
+@app.route("/api/progress/stream", methods=["GET"])
+def stream_progress():
+    """
+    Stream current progress as newline-delimited JSON.
+
+    The first line holds every progress field except the rows; each
+    following line is one row, in row order. Rows are encoded a chunk at
+    a time, so the full payload is never held in memory.
+    """
+    progress = load_progress()
+    etag = _progress_etag(progress)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    meta = {key: value for key, value in progress.items() if key != "rows"}
+    rows = progress["rows"]
+
+    def generate():
+        yield orjson.dumps(meta) + b"\n"
+        for start in range(0, len(rows), PROGRESS_STREAM_CHUNK_ROWS):
+            chunk = rows[start : start + PROGRESS_STREAM_CHUNK_ROWS]
+            yield b"".join(orjson.dumps(row) + b"\n" for row in chunk)
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    return _with_etag(response, etag)
 
 
 @app.route("/api/upload", methods=["POST"])
@@ -608,18 +1381,26 @@ def upload_file():
         # Read file content - check extensions case-insensitively
         filename_lower = file.filename.lower()
         if filename_lower.endswith(".csv"):
-            import csv
-
-            lines = file.read().decode("utf-8").split("\n")
-            reader = csv.DictReader(lines)
-            all_rows = list(reader)
-            # Filter out invalid rows (missing required fields)
-            rows = [row for row in all_rows if is_row_valid(row)]
-            skipped_count = len(all_rows) - len(rows)
+            # Parse straight off the upload stream instead of holding the raw
+            # bytes, decoded text and split lines in memory at the same time.
+            # utf-8-sig drops the byte order mark Excel puts on CSV exports,
+            # which would otherwise end up in the first column name.
+            stream = io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+            rows = []
+            row_is_valid = None
+            for row in iter_csv_rows(stream):
+                if row_is_valid is None:
+                    # Every record is keyed by the same header row
+                    row_is_valid = build_row_validator(row)
+                # Filter out invalid rows (missing required fields)
+                if row_is_valid(row):
+                    rows.append(row)
+                else:
+                    skipped_count += 1
             if skipped_count > 0:
                 print(f"Skipped {skipped_count} incomplete row(s) from CSV", flush=True)
         elif filename_lower.endswith(".json"):
-            all_rows = json.loads(file.read().decode("utf-8"))
+            all_rows = orjson.loads(file.read())
             # Filter out invalid rows
             rows = [row for row in all_rows if is_row_valid(row)]
             skipped_count = len(all_rows) - len(rows)
@@ -630,79 +1411,59 @@ def upload_file():
         else:
             return jsonify({"error": "Unsupported file format. Use CSV or JSON"}), 400
 
-        # Get file mapping history
-        file_mappings = load_file_mappings()
         file_hash = get_file_mapping_hash(rows)
 
-        # Initialize or update progress
-        progress = load_progress()
-        progress["file_name"] = file.filename
-        progress["total_rows"] = len(rows)
-
         # Check if we have previous mappings for this file
-        if file.filename in file_mappings["mappings"]:
-            previous_mapping = file_mappings["mappings"][file.filename]
-            # Check if file content has changed
-            if previous_mapping.get("file_hash") == file_hash:
+        with _file_mappings_lock:
+            file_mappings = load_file_mappings()
+            previous_mapping = file_mappings["mappings"].get(file.filename)
+            if previous_mapping and previous_mapping.get("file_hash") == file_hash:
                 # File unchanged - restore previous mappings and skip mapped rows
                 previous_rows = previous_mapping.get("rows", {})
-                restored_count = 0
-                for idx, row in enumerate(rows):
-                    row_key = str(idx)
-                    if row_key in previous_rows:
-                        # Restore previous mapping
-                        progress["rows"][row_key] = {
-                            "data": row,
-                            "category": previous_rows[row_key],
-                            "mapped": True,
-                        }
-                        restored_count += 1
-                    else:
-                        # New or unmapped row
-                        progress["rows"][row_key] = {
-                            "data": row,
-                            "category": None,
-                            "mapped": False,
-                        }
-                print(
-                    f"Restored {restored_count} previously mapped rows for '{file.filename}'",
-                    flush=True,
-                )
             else:
-                # File changed - reset all mappings
+                # New or changed file - initialize all rows as unmapped
                 file_mappings["mappings"][file.filename] = {
                     "file_hash": file_hash,
                     "rows": {},
                 }
-                for idx, row in enumerate(rows):
-                    row_key = str(idx)
-                    progress["rows"][row_key] = {
-                        "data": row,
-                        "category": None,
-                        "mapped": False,
-                    }
-        else:
-            # New file - initialize all rows as unmapped
-            file_mappings["mappings"][file.filename] = {
-                "file_hash": file_hash,
-                "rows": {},
-            }
-            for idx, row in enumerate(rows):
-                row_key = str(idx)
-                progress["rows"][row_key] = {
+                save_file_mappings(file_mappings)
+                previous_rows = {}
+
+        # Initialize or update progress
+        progress = load_progress()
+        progress["file_name"] = file.filename
+        progress["file_hash"] = file_hash
+        progress["total_rows"] = len(rows)
+
+        # Build the row entries in a single pass; this replaces any rows left
+        # over from a previously uploaded file
+        if previous_rows:
+            # file_mappings.json keeps string row keys
+            progress["rows"] = [
+                {
                     "data": row,
-                    "category": None,
-                    "mapped": False,
+                    "category": previous_rows.get(str(idx)),
+                    "mapped": str(idx) in previous_rows,
                 }
+                for idx, row in enumerate(rows)
+            ]
+        else:
+            progress["rows"] = [
+                {"data": row, "category": None, "mapped": False} for row in rows
+            ]
 
-        save_progress(progress)
-        save_file_mappings(file_mappings)
+        _count_mappings(progress)
+        if previous_rows:
+            print(
+                f"Restored {progress['mapped_count']} previously mapped rows for '{file.filename}'",
+                flush=True,
+            )
+        save_progress(progress, defer=False)
 
         response_data = {
             "success": True,
             "file_name": file.filename,
             "total_rows": len(rows),
-            "progress": progress,
         }
 
         # Build informational messages
@@ -712,9 +1473,7 @@ def upload_file():
         if file.filename in file_mappings["mappings"]:
             previous_mapping = file_mappings["mappings"][file.filename]
             if previous_mapping.get("file_hash") == file_hash:
-                restored_count = len(
-                    [r for r in progress["rows"].values() if r.get("mapped")]
-                )
+                restored_count = progress["mapped_count"]
                 if restored_count > 0:
                     messages.append(
                         f"Restored {restored_count} previously mapped row(s)"
@@ -737,10 +1496,13 @@ def upload_file():
 @app.route("/api/suggest-category", methods=["POST"])
 def suggest_category():
     """Suggest a category using LLM based on transaction data"""
-    # Create a trace for this operation
-    trace = tracer.create_trace(
-        name="suggest_category", metadata={"endpoint": "/api/suggest-category"}
-    )
+    # Create a trace for this operation. Every span below is guarded by
+    # "if trace", so with tracing off no trace metadata is built at all.
+    trace = None
+    if tracer.is_enabled():
+        trace = tracer.create_trace(
+            name="suggest_category", metadata={"endpoint": "/api/suggest-category"}
+        )
 
     try:
         data = request.json
@@ -775,18 +1537,7 @@ def suggest_category():
             ), 400
 
         # Get previous mappings as examples (mapped rows) - include full details
-        previous_mappings = []
-        if progress.get("rows"):
-            for row_data in progress["rows"].values():
-                if row_data.get("mapped") and row_data.get("category"):
-                    previous_mappings.append(
-                        {
-                            "date": row_data["data"].get("Date", ""),
-                            "amount": row_data["data"].get("Amount", ""),
-                            "description": row_data["data"].get("Description", ""),
-                            "category": row_data["category"],
-                        }
-                    )
+        previous_mappings, system_prompt = suggestion_context(progress, categories)
 
         if trace:
             tracer.add_span(
@@ -798,10 +1549,16 @@ def suggest_category():
                 },
             )
 
-        # Get LLM suggestion
-        result = get_llm_suggestion(
-            transaction_data, categories, previous_mappings, trace=trace
-        )
+        # Get LLM suggestion - a single transaction goes through the batch
+        # path as a batch of one. The row index only labels the prompt line.
+        batch_idx = row_index if isinstance(row_index, int) else 0
+        result = get_batch_llm_suggestions(
+            [(batch_idx, transaction_data)],
+            categories,
+            previous_mappings,
+            trace=trace,
+            system_prompt=system_prompt,
+        )[batch_idx]
 
         if result["success"]:
             if trace:
@@ -851,15 +1608,192 @@ def suggest_category():
                 pass
 
 
+def iter_bulk_suggestions(rows, unmapped_indices, categories, trace=None):
+    """
+    Suggest categories for the unmapped rows, yielding them as they're ready.
+
+    Cached merchants are answered first, without calling the LLM. The rest
+    are sent in batches of LLM_BATCH_SIZE rows, up to OLLAMA_MAX_PARALLEL at
+    a time, and each batch is yielded as soon as it finishes.
+
+    Args:
+        rows: Progress rows list
+        unmapped_indices: Indices of the rows to suggest categories for
+        categories: List of available budget categories
+        trace: Optional Langfuse trace object for logging
+
+    Yields:
+        Dicts of row index -> {data, suggestion, confirmed[, error]}
+    """
+    # Get previous mappings for context
+    previous_mappings = recent_mapping_examples(rows)
+
+    if trace:
+        tracer.add_span(
+            trace,
+            name="bulk_operation_start",
+            metadata={
+                "total_unmapped": len(unmapped_indices),
+                "context_mappings": len(previous_mappings),
+            },
+        )
+
+    batch_size = LLM_BATCH_SIZE
+    total_rows = len(unmapped_indices)
+    processed_count = 0
+
+    def record_result(mappings, idx, result_info):
+        nonlocal processed_count
+        transaction_data = rows[idx].get("data", {})
+        processed_count += 1
+
+        if result_info.get("success") and result_info.get("suggestion"):
+            mappings[idx] = {
+                "data": transaction_data,
+                "suggestion": result_info["suggestion"],
+                "confirmed": False,
+            }
+        else:
+            mappings[idx] = {
+                "data": transaction_data,
+                "suggestion": None,
+                "error": result_info.get("error", "Unknown error"),
+                "confirmed": False,
+            }
+
+        # Log progress
+        progress_pct = (processed_count / total_rows) * 100
+        print(
+            f"Bulk map progress: {processed_count}/{total_rows} ({progress_pct:.0f}%)",
+            flush=True,
+        )
+
+    # Answer recurring merchants from the suggestion cache up front, and
+    # send each remaining merchant to the LLM once, so batches only hold
+    # rows that need it. Rows sharing a merchant's cache key get the
+    # answer for the first such row.
+    categories_digest = categories_fingerprint(categories)
+    cached_mappings = {}
+    llm_indices = []
+    same_merchant_rows = {}
+    first_row_for_key = {}
+    for idx in unmapped_indices:
+        cache_key = suggestion_cache_key(rows[idx].get("data", {}), categories_digest)
+        cached_suggestion = get_cached_suggestion(cache_key)
+        if cached_suggestion is not None:
+            record_result(
+                cached_mappings, idx, {"success": True, "suggestion": cached_suggestion}
+            )
+        elif cache_key in first_row_for_key:
+            same_merchant_rows[first_row_for_key[cache_key]].append(idx)
+        else:
+            if cache_key is not None:
+                first_row_for_key[cache_key] = idx
+                same_merchant_rows[idx] = []
+            llm_indices.append(idx)
+
+    if trace:
+        tracer.add_span(
+            trace,
+            name="suggestion_cache",
+            metadata={
+                "cache_hits": len(cached_mappings),
+                "same_merchant_rows": total_rows
+                - len(cached_mappings)
+                - len(llm_indices),
+                "llm_rows": len(llm_indices),
+            },
+        )
+    if cached_mappings:
+        yield cached_mappings
+
+    # The categories and examples are the same for every batch. They are
+    # not updated mid-run, so Ollama can reuse this prefix's prefill.
+    system_prompt = build_batch_system_prompt(categories, previous_mappings)
+
+    def process_batch(batch_start, batch_indices):
+        # Create batch of (idx, transaction_data) tuples
+        transaction_batch = [(idx, rows[idx].get("data", {})) for idx in batch_indices]
+
+        # Create a trace for this batch. Langfuse sends it from its
+        # background thread; the caller flushes once when the bulk map ends.
+        batch_trace = None
+        if tracer.is_enabled():
+            batch_trace = tracer.create_trace(
+                name="process_batch",
+                metadata={
+                    "batch_start": batch_start,
+                    "batch_size": len(batch_indices),
+                    "row_indices": batch_indices,
+                },
+            )
+
+        # Get batch suggestions using optimized batch prompt
+        return get_batch_llm_suggestions(
+            transaction_batch,
+            categories,
+            previous_mappings,
+            trace=batch_trace,
+            system_prompt=system_prompt,
+        )
+
+    # Create batches of LLM_BATCH_SIZE rows each and send up to
+    # OLLAMA_MAX_PARALLEL of them to Ollama at a time
+    with ThreadPoolExecutor(max_workers=OLLAMA_MAX_PARALLEL) as executor:
+        batch_futures = [
+            executor.submit(
+                process_batch,
+                batch_start,
+                llm_indices[batch_start : batch_start + batch_size],
+            )
+            for batch_start in range(0, len(llm_indices), batch_size)
+        ]
+
+        try:
+            # Handle batches as they finish, so one slow batch doesn't hold
+            # back the results of those behind it
+            for batch_future in as_completed(batch_futures):
+                batch_mappings = {}
+                for idx, result_info in batch_future.result().items():
+                    record_result(batch_mappings, idx, result_info)
+                    for same_idx in same_merchant_rows.get(idx, ()):
+                        record_result(batch_mappings, same_idx, result_info)
+                yield batch_mappings
+        finally:
+            # Don't start batches nobody will read, e.g. after the client of
+            # a streamed bulk map disconnects
+            for batch_future in batch_futures:
+                batch_future.cancel()
+
+
+def _add_bulk_complete_span(trace, mappings_count, successful_count):
+    """Log the outcome of a bulk map to its trace"""
+    if trace:
+        tracer.add_span(
+            trace,
+            name="bulk_operation_complete",
+            output_text=f"Generated suggestions for {mappings_count} items",
+            metadata={
+                "total_processed": mappings_count,
+                "successful": successful_count,
+                "failed": mappings_count - successful_count,
+            },
+        )
+
+
 @app.route("/api/bulk-map", methods=["POST"])
 def bulk_map():
     """Bulk map all unmapped rows using AI with batch processing"""
-    # Create a trace for bulk operation
-    trace = tracer.create_trace(name="bulk_map", metadata={"endpoint": "/api/bulk-map"})
+    # Create a trace for bulk operation (spans are guarded by "if trace")
+    trace = None
+    if tracer.is_enabled():
+        trace = tracer.create_trace(
+            name="bulk_map", metadata={"endpoint": "/api/bulk-map"}
+        )
 
     try:
         progress = load_progress()
-        rows = progress.get("rows", {})
+        rows = progress.get("rows", [])
         categories = load_categories()
 
         if not categories:
@@ -874,7 +1808,7 @@ def bulk_map():
 
         # Find unmapped rows
         unmapped_indices = [
-            idx for idx, row_data in rows.items() if not row_data.get("mapped", False)
+            idx for idx, row_data in enumerate(rows) if not row_data.get("mapped", False)
         ]
 
         if not unmapped_indices:
@@ -895,119 +1829,19 @@ def bulk_map():
                 }
             ), 200
 
-        # Get previous mappings for context
-        previous_mappings = []
-        for row_data in rows.values():
-            if row_data.get("mapped") and row_data.get("category"):
-                previous_mappings.append(
-                    {
-                        "date": row_data["data"].get("Transaction Date", ""),
-                        "amount": row_data["data"].get("Amount", ""),
-                        "description": row_data["data"].get("Description", ""),
-                        "category": row_data["category"],
-                    }
-                )
-
-        if trace:
-            tracer.add_span(
-                trace,
-                name="bulk_operation_start",
-                metadata={
-                    "total_unmapped": len(unmapped_indices),
-                    "context_mappings": len(previous_mappings),
-                },
-            )
-
-        # Process in batches of 5 rows
         mappings = {}
-        batch_size = 5
-        total_rows = len(unmapped_indices)
-        processed_count = 0
-
-        # Create batches of 5 rows each
-        for batch_start in range(0, len(unmapped_indices), batch_size):
-            batch_end = min(batch_start + batch_size, len(unmapped_indices))
-            batch_indices = unmapped_indices[batch_start:batch_end]
-
-            # Create batch of (idx, transaction_data) tuples
-            transaction_batch = [
-                (idx, rows[idx].get("data", {})) for idx in batch_indices
-            ]
-
-            # Create a trace for this batch
-            batch_trace = tracer.create_trace(
-                name="process_batch",
-                metadata={
-                    "batch_start": batch_start,
-                    "batch_size": len(batch_indices),
-                    "row_indices": batch_indices,
-                },
-            )
-
-            # Get batch suggestions using optimized batch prompt
-            batch_results = get_batch_llm_suggestions(
-                transaction_batch, categories, previous_mappings, trace=batch_trace
-            )
-
-            # Flush the batch trace to send it to Langfuse
-            if batch_trace and tracer.is_enabled():
-                try:
-                    tracer.client.flush()
-                except Exception as e:
-                    print(f"Warning: Failed to flush batch trace: {e}", flush=True)
-
-            # Process batch results
-            for idx, result_info in batch_results.items():
-                transaction_data = rows[idx].get("data", {})
-                processed_count += 1
-
-                if result_info.get("success") and result_info.get("suggestion"):
-                    mappings[idx] = {
-                        "data": transaction_data,
-                        "suggestion": result_info["suggestion"],
-                        "confirmed": False,
-                    }
-
-                    # Add to previous mappings for context in future batches
-                    previous_mappings.append(
-                        {
-                            "date": transaction_data.get("Transaction Date", ""),
-                            "amount": transaction_data.get("Amount", ""),
-                            "description": transaction_data.get("Description", ""),
-                            "category": result_info["suggestion"],
-                        }
-                    )
-                else:
-                    mappings[idx] = {
-                        "data": transaction_data,
-                        "suggestion": None,
-                        "error": result_info.get("error", "Unknown error"),
-                        "confirmed": False,
-                    }
-
-                # Log progress
-                progress_pct = (processed_count / total_rows) * 100
-                print(
-                    f"Bulk map progress: {processed_count}/{total_rows} ({progress_pct:.0f}%)",
-                    flush=True,
-                )
-
-        if trace:
-            tracer.add_span(
-                trace,
-                name="bulk_operation_complete",
-                output_text=f"Generated suggestions for {len(mappings)} items",
-                metadata={
-                    "total_processed": len(mappings),
-                    "successful": sum(
-                        1 for m in mappings.values() if m.get("suggestion")
-                    ),
-                    "failed": sum(
-                        1 for m in mappings.values() if not m.get("suggestion")
-                    ),
-                },
-            )
+        for batch_mappings in iter_bulk_suggestions(
+            rows, unmapped_indices, categories, trace
+        ):
+            mappings.update(batch_mappings)
+
+        _add_bulk_complete_span(
+            trace,
+            len(mappings),
+            sum(1 for m in mappings.values() if m.get("suggestion")),
+        )
 
+        total_rows = len(unmapped_indices)
         return jsonify(
             {
                 "success": True,
@@ -1038,6 +1872,105 @@ def bulk_map():
                 pass
 
 
+@app.route("/api/bulk-map/stream", methods=["POST"])
+def bulk_map_stream():
+    """
+    Bulk map all unmapped rows, streaming suggestions as NDJSON.
+
+    Each line carries the mappings of one finished batch (cached merchants
+    come first) and the running progress:
+    {"mappings": {...}, "progress": {"current": n, "total": N}}
+    With no unmapped rows there is a single line with empty mappings.
+    A failure after streaming has started is reported as a final
+    {"success": false, "error": ...} line.
+    """
+    trace = None
+    if tracer.is_enabled():
+        trace = tracer.create_trace(
+            name="bulk_map", metadata={"endpoint": "/api/bulk-map/stream"}
+        )
+
+    progress = load_progress()
+    rows = progress.get("rows", [])
+    categories = load_categories()
+
+    if not categories:
+        if trace:
+            tracer.add_span(
+                trace,
+                name="no_categories",
+                output_text="No categories available",
+                metadata={"error": True},
+            )
+            try:
+                tracer.client.flush()
+            except Exception:
+                pass
+        return jsonify({"success": False, "error": "No categories available"}), 400
+
+    # Find unmapped rows
+    unmapped_indices = [
+        idx for idx, row_data in enumerate(rows) if not row_data.get("mapped", False)
+    ]
+    total_rows = len(unmapped_indices)
+
+    def generate():
+        processed_count = 0
+        successful_count = 0
+        try:
+            if not unmapped_indices:
+                if trace:
+                    tracer.add_span(
+                        trace,
+                        name="all_mapped",
+                        output_text="No unmapped rows",
+                        metadata={"unmapped_count": 0},
+                    )
+                # One line, so the client still gets a response to finish on
+                yield orjson.dumps(
+                    {"mappings": {}, "progress": {"current": 0, "total": 0}}
+                ) + b"\n"
+                return
+
+            for batch_mappings in iter_bulk_suggestions(
+                rows, unmapped_indices, categories, trace
+            ):
+                processed_count += len(batch_mappings)
+                successful_count += sum(
+                    1 for m in batch_mappings.values() if m.get("suggestion")
+                )
+                yield orjson.dumps(
+                    {
+                        "mappings": batch_mappings,
+                        "progress": {"current": processed_count, "total": total_rows},
+                    },
+                    option=orjson.OPT_NON_STR_KEYS,
+                ) + b"\n"
+            _add_bulk_complete_span(trace, processed_count, successful_count)
+        except Exception as e:
+            print(f"Error in bulk_map_stream: {str(e)}", flush=True)
+            if trace:
+                tracer.add_span(
+                    trace,
+                    name="exception",
+                    input_text=type(e).__name__,
+                    output_text=str(e),
+                    metadata={"error": True},
+                )
+            yield orjson.dumps(
+                {"success": False, "error": f"Server error: {str(e)}"}
+            ) + b"\n"
+        finally:
+            # Flush the trace
+            if tracer.is_enabled():
+                try:
+                    tracer.client.flush()
+                except Exception:
+                    pass
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
 @app.route("/api/add-category", methods=["POST"])
 def add_category():
     """Add a new custom category"""
@@ -1050,19 +1983,14 @@ def add_category():
     # Validate and correct the category
     validation = validate_and_correct_category(category_name)
 
-    # Load current categories
-    categories = load_categories()
-
     # Check if category already exists (case-insensitive)
-    category_lower = validation["corrected"].lower()
-    for cat in categories:
-        if cat.lower() == category_lower:
-            return jsonify(
-                {
-                    "error": f"Category '{validation['corrected']}' already exists",
-                    "validation": validation,
-                }
-            ), 400
+    if category_exists(validation["corrected"]):
+        return jsonify(
+            {
+                "error": f"Category '{validation['corrected']}' already exists",
+                "validation": validation,
+            }
+        ), 400
 
     # Return validation result for user confirmation
     return jsonify(
@@ -1082,18 +2010,14 @@ def confirm_add_category():
     if not corrected_category:
         return jsonify({"error": "Category name is required"}), 400
 
-    # Load current categories
-    categories = load_categories()
-
     # Check if category already exists
-    category_lower = corrected_category.lower()
-    for cat in categories:
-        if cat.lower() == category_lower:
-            return jsonify(
-                {"error": f"Category '{corrected_category}' already exists"}
-            ), 400
+    if category_exists(corrected_category):
+        return jsonify(
+            {"error": f"Category '{corrected_category}' already exists"}
+        ), 400
 
     # Add new category
+    categories = load_categories()
     categories.append(corrected_category)
     # Sort alphabetically (case-insensitive)
     categories.sort(key=str.lower)
@@ -1115,49 +2039,65 @@ def map_row():
     row_idx = data.get("row_index")
     category = data.get("category")
 
-    categories = load_categories()
-    if category not in categories:
+    if not isinstance(category, str) or category not in load_category_set():
         return jsonify({"error": "Invalid category"}), 400
 
     progress = load_progress()
-    row_key = str(row_idx)
-
-    if row_key not in progress["rows"]:
+    # Row indices are JSON integers; true/false and 1.7 don't name a row
+    if (
+        not isinstance(row_idx, int)
+        or isinstance(row_idx, bool)
+        or not 0 <= row_idx < len(progress["rows"])
+    ):
         return jsonify({"error": "Row not found"}), 404
 
-    progress["rows"][row_key]["category"] = category
-    progress["rows"][row_key]["mapped"] = True
+    log_row_mapping(progress, row_idx, category)
 
-    save_progress(progress)
+    # The user's choice replaces any cached LLM answer for this merchant, so
+    # its later transactions are suggested the category the user picked
+    cache_suggestion(
+        suggestion_cache_key(
+            progress["rows"][row_idx].get("data", {}),
+            categories_fingerprint(load_categories()),
+        ),
+        category,
+    )
 
     # Also save to file mappings if file is set
     if progress.get("file_name"):
-        file_mappings = load_file_mappings()
         file_name = progress["file_name"]
 
-        # Get current file hash from progress or preserve existing
-        rows_data = [row_data.get("data", {}) for row_data in progress["rows"].values()]
-        current_file_hash = get_file_mapping_hash(rows_data)
-
-        if file_name not in file_mappings["mappings"]:
-            file_mappings["mappings"][file_name] = {
-                "file_hash": current_file_hash,
-                "rows": {},
-            }
-        else:
-            # Update hash if not set
-            if not file_mappings["mappings"][file_name].get("file_hash"):
-                file_mappings["mappings"][file_name]["file_hash"] = current_file_hash
+        # The hash is recorded at upload, so a click doesn't rehash every row
+        current_file_hash = progress.get("file_hash")
+        if current_file_hash is None:
+            # Progress saved before the hash was recorded
+            rows_data = [row_data.get("data", {}) for row_data in progress["rows"]]
+            current_file_hash = get_file_mapping_hash(rows_data)
+            progress["file_hash"] = current_file_hash
+
+        with _file_mappings_lock:
+            file_mappings = load_file_mappings()
+            if file_name not in file_mappings["mappings"]:
+                file_mappings["mappings"][file_name] = {
+                    "file_hash": current_file_hash,
+                    "rows": {},
+                }
+            else:
+                # Update hash if not set
+                if not file_mappings["mappings"][file_name].get("file_hash"):
+                    file_mappings["mappings"][file_name]["file_hash"] = current_file_hash
 
-        file_mappings["mappings"][file_name]["rows"][row_key] = category
-        save_file_mappings(file_mappings)
+            file_mappings["mappings"][file_name]["rows"][str(row_idx)] = category
+            save_file_mappings(file_mappings)
 
+    rows = progress["rows"]
     return jsonify(
         {
             "success": True,
             "row_index": row_idx,
             "category": category,
-            "progress": progress,
+            "mapped_rows": progress["mapped_count"],
+            "total_rows": len(rows),
         }
     ), 200
 
@@ -1172,18 +2112,21 @@ def reset_file():
         return jsonify({"error": "file_name is required"}), 400
 
     # Remove file mappings
-    file_mappings = load_file_mappings()
-    if file_name in file_mappings["mappings"]:
-        del file_mappings["mappings"][file_name]
-        save_file_mappings(file_mappings)
+    with _file_mappings_lock:
+        file_mappings = load_file_mappings()
+        if file_name in file_mappings["mappings"]:
+            del file_mappings["mappings"][file_name]
+            save_file_mappings(file_mappings)
 
     # Clear progress rows for this file but keep rows data
     progress = load_progress()
     if progress.get("file_name") == file_name:
-        for row in progress["rows"].values():
+        for row in progress["rows"]:
             row["category"] = None
             row["mapped"] = False
-        save_progress(progress)
+        progress["mapped_count"] = 0
+        progress["category_counts"] = {}
+        save_progress(progress, defer=False)
 
     return jsonify(
         {
@@ -1198,18 +2141,17 @@ def reset_file():
 def get_stats():
     """Get mapping statistics"""
     progress = load_progress()
-    rows = progress.get("rows", {})
+    etag = _progress_etag(progress)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
 
-    total = len(rows)
-    mapped = sum(1 for row in rows.values() if row.get("mapped", False))
+    # Counters are maintained as rows are mapped, so no per-row scan is needed
+    total = len(progress.get("rows", []))
+    mapped = progress.get("mapped_count", 0)
+    category_counts = progress.get("category_counts", {})
 
-    category_counts = {}
-    for row in rows.values():
-        if row.get("mapped"):
-            cat = row.get("category")
-            category_counts[cat] = category_counts.get(cat, 0) + 1
-
-    return jsonify(
+    response = jsonify(
         {
             "total_rows": total,
             "mapped_rows": mapped,
@@ -1218,7 +2160,60 @@ def get_stats():
             "file_name": progress.get("file_name"),
             "last_updated": progress.get("last_updated"),
         }
-    ), 200
+    )
+    return _with_etag(response, etag), 200
+
+
+# Transaction types that move money rather than spend it, left out of
+# analytics
+NON_SPENDING_TYPES = frozenset({"payment", "credit", "refund"})
+
+# Date formats tried, in order, when grouping transactions by month
+ANALYTICS_DATE_FORMATS = (
+    "%m/%d/%Y",
+    "%m/%d/%y",  # 12/30/2024, 12/30/24
+    "%Y-%m-%d",  # 2024-12-30
+    "%d-%m-%Y",  # 30-12-2024
+    "%b %d, %Y",  # Dec 30, 2024
+    "%B %d, %Y",  # December 30, 2024
+)
+
+
+@lru_cache(maxsize=4096)
+def month_key_for_date(date_str):
+    """
+    Return the "YYYY-MM" month a transaction date falls in, or None.
+
+    Statements repeat the same few dates across many rows, so results are
+    memoized rather than running every strptime format for every row.
+    """
+    # Most exports use MM/DD/YYYY, whose month is a fixed slice - both the
+    # strptime and the split paths below give the same key for it (strftime
+    # doesn't zero-pad years before 1000, so those take the slow path)
+    if (
+        len(date_str) == 10
+        and date_str[2] == "/"
+        and date_str[5] == "/"
+        and date_str.count("/") == 2
+        and date_str.isascii()
+        and date_str[6] != "0"
+    ):
+        return date_str[6:] + "-" + date_str[:2]
+
+    for fmt in ANALYTICS_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt).strftime("%Y-%m")
+        except ValueError:
+            continue
+
+    # Fallback to simple split if no formats match
+    date_parts = date_str.split("/")
+    if len(date_parts) != 3:
+        return None
+    month, _day, year = date_parts
+    if len(year) == 2:
+        year = "20" + year
+    return f"{year}-{month:0>2}"
 
 
 @app.route("/api/analytics", methods=["GET"])
@@ -1226,38 +2221,36 @@ def get_analytics():
     """Get spending analytics by category and month"""
     try:
         progress = load_progress()
-        rows = progress.get("rows", {})
+        rows = progress.get("rows", [])
 
         # Dictionary to store spending by month and category
         # Format: {"2024-11": {"Food & Groceries": 100.50, ...}, ...}
         spending_by_month = {}
 
-        for row_data in rows.values():
+        for row_data in rows:
             # Only process mapped rows
             if not row_data.get("mapped"):
                 continue
 
             row_info = row_data.get("data", {})
             category = row_data.get("category")
-            amount_str = row_info.get("Amount", "0")
-            date_str = row_info.get("Transaction Date", "")
-            transaction_type = row_info.get("Type", "").lower()
-
-            # Parse amount
-            try:
-                amount = float(amount_str)
-            except (ValueError, TypeError):
-                continue
 
-            # Skip payments/credits based on Type field or category
+            # Skip payments/credits based on Type field or category before
+            # parsing anything else from the row.
             # Check Type field if present (e.g., "Payment", "Credit")
-            if transaction_type in ["payment", "credit", "refund"]:
+            if row_info.get("Type", "").lower() in NON_SPENDING_TYPES:
                 continue
 
             # Skip if categorized as Payment
             if category and category.lower() == "payment":
                 continue
 
+            # Parse amount
+            try:
+                amount = float(row_info.get("Amount", "0"))
+            except (ValueError, TypeError):
+                continue
+
             # Convert to absolute value for spending
             # (handles both positive and negative expense formats)
             amount = abs(amount)
@@ -1267,42 +2260,13 @@ def get_analytics():
                 continue
 
             # Parse date - try different formats
+            date_str = row_info.get("Transaction Date", "")
             if not date_str:
                 continue
 
-            month_key = None
-            date_formats = [
-                "%m/%d/%Y",
-                "%m/%d/%y",  # 12/30/2024, 12/30/24
-                "%Y-%m-%d",  # 2024-12-30
-                "%d-%m-%Y",  # 30-12-2024
-                "%b %d, %Y",  # Dec 30, 2024
-                "%B %d, %Y",  # December 30, 2024
-            ]
-
-            for fmt in date_formats:
-                try:
-                    dt = datetime.strptime(date_str, fmt)
-                    month_key = dt.strftime("%Y-%m")
-                    break
-                except ValueError:
-                    continue
-
+            month_key = month_key_for_date(date_str)
             if not month_key:
-                # Fallback to simple split if no formats match
-                try:
-                    date_parts = date_str.split("/")
-                    if len(date_parts) == 3:
-                        month = date_parts[0]
-                        day = date_parts[1]
-                        year = date_parts[2]
-                        if len(year) == 2:
-                            year = "20" + year
-                        month_key = f"{year}-{month:0>2}"
-                    else:
-                        continue
-                except:
-                    continue
+                continue
 
             # Initialize month if not exists
             if month_key not in spending_by_month:
@@ -1324,8 +2288,8 @@ def get_analytics():
                 category_totals[category] += amount
 
         # Sort months chronologically
-        sorted_months = sorted(spending_by_month.keys())
-        sorted_spending = {month: spending_by_month[month] for month in sorted_months}
+        sorted_spending = dict(sorted(spending_by_month.items()))
+        sorted_months = list(sorted_spending)
 
         return jsonify(
             {
@@ -1342,4 +2306,14 @@ def get_analytics():
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Development server only - production runs under gunicorn (see
+    # gunicorn.conf.py). FLASK_DEBUG=0 turns off the reloader and debugger
+    # so the progress state isn't loaded in a second reloader process. The
+    # value is read as Flask reads it, except that unset means on.
+    debug_flag = os.getenv("FLASK_DEBUG", "1")
+    app.run(
+        debug=bool(debug_flag) and debug_flag.lower() not in ("0", "false", "no"),
+        host="0.0.0.0",
+        port=5000,
+        threaded=True,
+    )
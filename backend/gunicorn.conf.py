@@ -0,0 +1,21 @@
+"""
+Gunicorn settings for serving the budget_claude backend.
+
+Progress is cached and written in-process, so the app must run in a single
+worker process. Concurrency comes from that worker's threads: LLM requests
+spend their time waiting on Ollama, and the blocked threads release the
+GIL while they wait.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Do not raise - each worker would hold its own copy of the progress state
+workers = 1
+worker_class = "gthread"
+# Requests served at once, e.g. suggestions while a bulk map is running
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Matches the frontend's bulk-map timeout
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "900"))
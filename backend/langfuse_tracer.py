@@ -16,6 +16,9 @@ try:
 except ImportError:
     LANGFUSE_AVAILABLE = False
 
+# Placed between the head and tail of truncated prompts and responses
+TRUNCATION_MARKER = "\n\n[... truncated ...]\n\n"
+
 
 class LangfuseTracer:
     """Wrapper for Langfuse client with budget_claude-specific configuration."""
@@ -26,6 +29,8 @@ class LangfuseTracer:
         public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
         self.enabled = LANGFUSE_AVAILABLE and public_key is not None and public_key.strip() != ""
         self.client = None
+        # Set LANGFUSE_TRUNCATE=0 to log full prompts and responses
+        self.truncate = os.getenv("LANGFUSE_TRUNCATE", "1").strip() != "0"
 
         if self.enabled:
             try:
@@ -94,7 +99,7 @@ class LangfuseTracer:
             model: Model name (e.g., "llama3.1:8b")
             input_text: Input/prompt sent to the model
             output_text: Output/response from the model
-            usage: Optional dict with "prompt_tokens" and "completion_tokens"
+            usage: Optional dict with "input" and "output" token counts
             metadata: Optional additional metadata
         """
         if not trace:
@@ -102,20 +107,22 @@ class LangfuseTracer:
 
         try:
             # Create metadata with size information
+            input_length = len(input_text) if input_text else 0
+            output_length = len(output_text) if output_text else 0
             gen_metadata = metadata or {}
-            gen_metadata["input_length"] = len(input_text) if input_text else 0
-            gen_metadata["output_length"] = len(output_text) if output_text else 0
+            gen_metadata["input_length"] = input_length
+            gen_metadata["output_length"] = output_length
 
             # For large prompts (>10KB), truncate the input to first 5KB and last 2KB for readability
             truncated_input = input_text
-            if len(input_text) > 10000:
-                truncated_input = input_text[:5000] + "\n\n[... truncated ...]\n\n" + input_text[-2000:]
+            if self.truncate and input_length > 10000:
+                truncated_input = TRUNCATION_MARKER.join((input_text[:5000], input_text[-2000:]))
                 gen_metadata["input_truncated"] = True
 
             # For large outputs (>5KB), truncate to first 2KB and last 2KB
             truncated_output = output_text
-            if len(output_text) > 5000:
-                truncated_output = output_text[:2000] + "\n\n[... truncated ...]\n\n" + output_text[-2000:]
+            if self.truncate and output_length > 5000:
+                truncated_output = TRUNCATION_MARKER.join((output_text[:2000], output_text[-2000:]))
                 gen_metadata["output_truncated"] = True
 
             # Build kwargs for generation call, only including usage if it has valid data
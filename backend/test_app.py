@@ -0,0 +1,741 @@
+"""
+Tests for app.py.
+
+Run from the backend directory with: poetry run pytest
+"""
+
+import csv
+import hashlib
+import io
+import json
+import random
+import re
+from datetime import datetime
+
+import orjson
+import pytest
+
+import app
+
+
+@pytest.fixture
+def progress_files(tmp_path, monkeypatch):
+    """Point the progress snapshot and mapping log at a temp directory"""
+    monkeypatch.setattr(app, "PROGRESS_FILE", tmp_path / "mapping_progress.json")
+    monkeypatch.setattr(app, "PROGRESS_LOG_FILE", tmp_path / "mapping_progress.log")
+    monkeypatch.setitem(app._progress_cache, "data", None)
+    monkeypatch.setitem(app._progress_writer, "timer", None)
+    monkeypatch.setitem(app._progress_writer, "last_write", 0.0)
+    yield tmp_path
+    timer = app._progress_writer["timer"]
+    if timer is not None:
+        timer.cancel()
+
+
+def reload_progress():
+    """Drop the in-memory progress and read it back from disk"""
+    app._progress_cache["data"] = None
+    return app.load_progress()
+
+
+def new_progress(descriptions):
+    progress = {
+        "file_name": "test.csv",
+        "file_hash": "abc",
+        "rows": [
+            {"data": {"Description": d}, "category": None, "mapped": False}
+            for d in descriptions
+        ],
+        "total_rows": len(descriptions),
+    }
+    app._count_mappings(progress)
+    return progress
+
+
+@pytest.fixture
+def suggestion_cache(tmp_path, monkeypatch):
+    """Start each test with an empty suggestion cache in a temp database"""
+    monkeypatch.setattr(app, "LLM_CACHE_FILE", tmp_path / "llm_cache.db")
+    monkeypatch.setattr(app, "_suggestion_cache", app.OrderedDict())
+    monkeypatch.setitem(app._suggestion_db, "conn", None)
+    monkeypatch.setitem(app._suggestion_db, "categories", None)
+    yield app.LLM_CACHE_FILE
+    if app._suggestion_db["conn"] is not None:
+        app._suggestion_db["conn"].close()
+
+
+@pytest.fixture
+def client(progress_files, suggestion_cache, tmp_path, monkeypatch):
+    """Flask test client with every state file in a temp directory"""
+    monkeypatch.setattr(app, "FILE_MAPPINGS_FILE", tmp_path / "file_mappings.json")
+    monkeypatch.setitem(app._file_mappings_writer, "timer", None)
+    monkeypatch.setitem(app._file_mappings_writer, "last_write", 0.0)
+    yield app.app.test_client()
+    timer = app._file_mappings_writer["timer"]
+    if timer is not None:
+        timer.cancel()
+
+
+class FakeOllama:
+    """Stands in for Ollama's /api/chat, answering batches with reply(rows)"""
+
+    def __init__(self):
+        self.requests = []
+        self.reply = lambda rows: {
+            "mappings": [{"row": row, "category": "Other"} for row in rows]
+        }
+
+    @property
+    def batches(self):
+        """Row indices sent in each request, in order"""
+        return [
+            [int(row) for row in re.findall(r"^Row (\d+): Date", text, re.M)]
+            for text in (
+                request["messages"][-1]["content"] for request in self.requests
+            )
+        ]
+
+    def post(self, url, json=None, timeout=None):
+        self.requests.append(json)
+        reply = self.reply(self.batches[-1])
+        content = reply if isinstance(reply, str) else orjson.dumps(reply).decode()
+        return FakeResponse(
+            {"message": {"content": content}, "prompt_eval_count": 1, "eval_count": 1}
+        )
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    fake = FakeOllama()
+    monkeypatch.setattr(app.ollama_session, "post", fake.post)
+    return fake
+
+
+def transactions(count, start=0):
+    """(idx, transaction_data) pairs for distinct merchants"""
+    return [
+        (
+            idx,
+            {
+                "Date": "01/02/2024",
+                "Amount": "-1.00",
+                "Description": f"Merchant {chr(65 + idx % 26)}{chr(65 + idx // 26)}",
+            },
+        )
+        for idx in range(start, start + count)
+    ]
+
+
+def upload_csv(client, text, file_name="test.csv"):
+    response = client.post(
+        "/api/upload",
+        data={"file": (io.BytesIO(text.encode()), file_name)},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    return response
+
+
+# --- Progress snapshot and mapping log ---
+
+
+def test_empty_progress_without_files(progress_files):
+    progress = app.load_progress()
+    assert progress["rows"] == []
+    assert progress["mapped_count"] == 0
+
+
+def test_logged_mappings_replay_onto_snapshot(progress_files):
+    app.save_progress(new_progress(["A", "B", "C"]), defer=False)
+    progress = app.load_progress()
+    app.log_row_mapping(progress, 0, "Food & Groceries")
+    app.log_row_mapping(progress, 2, "Shopping")
+    app.log_row_mapping(progress, 0, "Transportation")
+    expected = json.loads(orjson.dumps(progress))
+
+    # The snapshot still holds the unmapped rows; the log holds the clicks
+    snapshot = orjson.loads(app.PROGRESS_FILE.read_bytes())
+    assert snapshot["mapped_count"] == 0
+    assert len(app.PROGRESS_LOG_FILE.read_bytes().splitlines()) == 3
+
+    reloaded = reload_progress()
+    assert reloaded == expected
+    assert [row["category"] for row in reloaded["rows"]] == [
+        "Transportation",
+        None,
+        "Shopping",
+    ]
+    assert reloaded["mapped_count"] == 2
+    assert reloaded["category_counts"] == {"Transportation": 1, "Shopping": 1}
+
+
+def test_partial_log_line_is_ignored(progress_files):
+    app.save_progress(new_progress(["A", "B"]), defer=False)
+    app.log_row_mapping(app.load_progress(), 1, "Other")
+    with open(app.PROGRESS_LOG_FILE, "ab") as f:
+        f.write(b'{"row": 0, "categ')
+
+    reloaded = reload_progress()
+    assert [row["category"] for row in reloaded["rows"]] == [None, "Other"]
+    assert reloaded["mapped_count"] == 1
+
+
+def test_log_compaction_round_trip(progress_files, monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS_LOG_MAX_BYTES", 1)
+    app.save_progress(new_progress(["A", "B", "C"]), defer=False)
+    progress = app.load_progress()
+    for row_idx, category in enumerate(["Food & Groceries", "Healthcare", "Other"]):
+        app.log_row_mapping(progress, row_idx, category)
+    app.flush_pending_writes()
+    expected = json.loads(orjson.dumps(progress))
+
+    # Compaction folds the log into the snapshot and truncates the log
+    assert app.PROGRESS_LOG_FILE.read_bytes() == b""
+    assert orjson.loads(app.PROGRESS_FILE.read_bytes()) == expected
+    assert reload_progress() == expected
+
+
+def test_replacing_rows_is_not_mixed_with_earlier_log(progress_files):
+    app.save_progress(new_progress(["AAA", "AAA2"]), defer=False)
+    # A second upload right away, inside the save interval
+    app.save_progress(new_progress(["BBB0", "BBB"]), defer=False)
+    app.log_row_mapping(app.load_progress(), 1, "Transportation")
+
+    reloaded = reload_progress()
+    assert [
+        (row["data"]["Description"], row["category"]) for row in reloaded["rows"]
+    ] == [("BBB0", None), ("BBB", "Transportation")]
+
+
+def test_legacy_snapshot_with_row_dict_and_no_counters(progress_files):
+    app.PROGRESS_FILE.write_bytes(
+        orjson.dumps(
+            {
+                "file_name": "old.csv",
+                "rows": {
+                    "10": {"data": {}, "category": None, "mapped": False},
+                    "2": {"data": {}, "category": "Other", "mapped": True},
+                    "0": {"data": {}, "category": "Other", "mapped": True},
+                },
+                "total_rows": 3,
+                "last_updated": None,
+            }
+        )
+    )
+
+    progress = app.load_progress()
+    assert [row["category"] for row in progress["rows"]] == ["Other", "Other", None]
+    assert progress["mapped_count"] == 2
+    assert progress["category_counts"] == {"Other": 2}
+
+
+# --- Row mapping ---
+
+
+@pytest.mark.parametrize("row_index", [True, False, 1.7, 1.0, "1", None, -1, 2])
+def test_map_row_rejects_rows_that_are_not_integer_indices(client, row_index):
+    upload_csv(client, "Date,Amount,Description\n1/1/2024,-1,A\n1/2/2024,-2,B\n")
+
+    response = client.post(
+        "/api/map-row", json={"row_index": row_index, "category": "Other"}
+    )
+    assert response.status_code == 404
+    assert app.load_progress()["mapped_count"] == 0
+
+
+def test_map_row_maps_integer_index(client):
+    upload_csv(client, "Date,Amount,Description\n1/1/2024,-1,A\n1/2/2024,-2,B\n")
+
+    response = client.post("/api/map-row", json={"row_index": 1, "category": "Other"})
+    assert response.status_code == 200
+    assert [row["category"] for row in reload_progress()["rows"]] == [None, "Other"]
+
+
+# --- CSV parsing ---
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "Date,Amount,Description\n",
+        "Date,Amount,Description\n01/01/2024,-5.00,Coffee\n01/02/2024,10,Refund\n",
+        "Date,Amount,Description\n01/01/2024,-5.00\n",
+        "Date,Amount,Description\n01/01/2024,-5.00,Coffee,extra,more\n",
+        "Date,Amount,Description\n\n01/01/2024,-5.00,Coffee\n\n",
+        'Date,Amount,Description\n01/01/2024,"-1,000.00","Multi\nline, quoted"\n',
+        "Date,Amount,Description\r\n01/01/2024,-5.00,Coffee\r\n",
+        "Date,Date,Amount\n01/01/2024,01/02/2024,3\n",
+    ],
+)
+def test_iter_csv_rows_matches_dict_reader(text):
+    expected = list(csv.DictReader(io.StringIO(text, newline="")))
+    assert list(app.iter_csv_rows(io.StringIO(text, newline=""))) == expected
+
+
+def test_iter_csv_rows_matches_dict_reader_on_ragged_rows():
+    rng = random.Random(0)
+    lines = ["Date,Amount,Description,Type"]
+    for _ in range(500):
+        fields = [str(rng.randint(0, 99)) for _ in range(rng.randint(0, 6))]
+        lines.append(",".join(fields))
+    text = "\n".join(lines) + "\n"
+
+    expected = list(csv.DictReader(io.StringIO(text, newline="")))
+    assert list(app.iter_csv_rows(io.StringIO(text, newline=""))) == expected
+
+
+# --- File hashing ---
+
+
+@pytest.mark.parametrize("row_count", [0, 1, 999, 1000, 1001, 2500])
+def test_file_mapping_hash_matches_whole_document_hash(row_count):
+    rows = [
+        {
+            "Date": f"01/{i % 28 + 1:02d}/2024",
+            "Amount": str(-i),
+            "Description": f"Café {i} ☕",
+        }
+        for i in range(row_count)
+    ]
+    expected = hashlib.sha256(json.dumps(rows, sort_keys=True).encode()).hexdigest()
+    assert app.get_file_mapping_hash(rows) == expected
+
+
+# --- Batch LLM responses ---
+
+CATEGORIES = ["Food & Groceries", "Transportation", "Other"]
+
+
+@pytest.mark.parametrize(
+    "response_text",
+    [
+        "",
+        "Row 1: Other",
+        "not json {",
+        "[1, 2, 3]",
+        '"mappings"',
+        "null",
+        '{"mappings": 5}',
+        '{"mappings": {"row": 1, "category": "Other"}}',
+        '{"rows": [{"row": 1, "category": "Other"}]}',
+    ],
+)
+def test_parse_batch_response_malformed_reply_has_no_rows(response_text):
+    lookup = app.build_category_lookup(CATEGORIES)
+    assert app.parse_batch_response(response_text, lookup, {0, 1, 2}) == {}
+
+
+def test_parse_batch_response_skips_malformed_items():
+    lookup = app.build_category_lookup(CATEGORIES)
+    response_text = orjson.dumps(
+        {
+            "mappings": [
+                {"row": 0, "category": "Food & Groceries"},
+                {"row": 1, "category": " transportation "},
+                {"row": 2, "category": "Nope"},
+                {"row": 3},
+                {"category": "Other"},
+                {"row": "4", "category": "Other"},
+                {"row": True, "category": "Other"},
+                {"row": 1.9, "category": "Other"},
+                {"row": None, "category": "Other"},
+                {"row": 99, "category": "Other"},
+                {"row": 6, "category": None},
+                "Row 4: Other",
+                7,
+                {"row": 5, "category": "Other"},
+            ]
+        }
+    ).decode()
+
+    assert app.parse_batch_response(response_text, lookup, set(range(7))) == {
+        0: "Food & Groceries",
+        1: "Transportation",
+        2: None,
+        5: "Other",
+    }
+
+
+# --- Batch LLM suggestions ---
+
+
+def test_unusable_batch_is_retried_once_in_halves(ollama, suggestion_cache):
+    ollama.reply = lambda rows: "not json"
+
+    results = app.get_batch_llm_suggestions(
+        transactions(20), CATEGORIES, [], system_prompt="system"
+    )
+
+    # The batch, then its two halves - and no further splitting
+    assert [len(batch) for batch in ollama.batches] == [20, 10, 10]
+    assert sorted(results) == list(range(20))
+    assert not any(result["success"] for result in results.values())
+
+
+def test_retried_halves_recover_unanswered_rows(ollama, suggestion_cache):
+    ollama.reply = lambda rows: {
+        "mappings": [
+            {"row": row, "category": "Other"} for row in rows if len(rows) <= 10
+        ]
+    }
+
+    results = app.get_batch_llm_suggestions(
+        transactions(20), CATEGORIES, [], system_prompt="system"
+    )
+
+    assert [len(batch) for batch in ollama.batches] == [20, 10, 10]
+    assert all(result["suggestion"] == "Other" for result in results.values())
+
+
+def needed_tokens(batch):
+    system_prompt, user_prompt = app.build_batch_llm_prompt(
+        batch, CATEGORIES, [], "system"
+    )
+    prompt_tokens = (len(system_prompt) + len(user_prompt)) // app.CHARS_PER_TOKEN
+    return prompt_tokens + app.RESPONSE_TOKENS_PER_ROW * len(batch)
+
+
+def test_batch_too_large_for_context_is_split(ollama, suggestion_cache, monkeypatch):
+    monkeypatch.setattr(app, "OLLAMA_NUM_CTX", needed_tokens(transactions(4)))
+
+    results = app.get_batch_llm_suggestions(
+        transactions(8), CATEGORIES, [], system_prompt="system"
+    )
+
+    assert ollama.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert all(result["suggestion"] == "Other" for result in results.values())
+    assert all(
+        request["options"]["num_ctx"] == app.OLLAMA_NUM_CTX
+        for request in ollama.requests
+    )
+
+
+def test_single_row_is_sent_even_if_over_context(ollama, suggestion_cache, monkeypatch):
+    monkeypatch.setattr(app, "OLLAMA_NUM_CTX", 1)
+
+    results = app.get_batch_llm_suggestions(
+        transactions(1), CATEGORIES, [], system_prompt="system"
+    )
+
+    assert ollama.batches == [[0]]
+    assert results[0]["suggestion"] == "Other"
+
+
+def test_generation_usage_uses_langfuse_keys(ollama, suggestion_cache, monkeypatch):
+    generations = []
+    monkeypatch.setattr(
+        app.tracer, "add_generation", lambda trace, **kwargs: generations.append(kwargs)
+    )
+    monkeypatch.setattr(app.tracer, "add_span", lambda trace, **kwargs: None)
+
+    app.get_batch_llm_suggestions(
+        transactions(2), CATEGORIES, [], trace=object(), system_prompt="system"
+    )
+
+    # LangfuseTracer.add_generation drops usage dicts without these keys
+    assert [generation["usage"] for generation in generations] == [
+        {"input": 1, "output": 1}
+    ]
+
+
+# --- Suggestion cache ---
+
+
+def cache_key(description, categories=CATEGORIES):
+    return app.suggestion_cache_key(
+        {"Description": description, "Amount": "-1.00"},
+        app.categories_fingerprint(categories),
+    )
+
+
+def forget_in_memory_cache():
+    """Drop the LRU and the connection, as a restart would"""
+    app._suggestion_cache.clear()
+    app._suggestion_db["conn"].close()
+    app._suggestion_db["conn"] = None
+    app._suggestion_db["categories"] = None
+
+
+def test_cached_suggestions_survive_a_restart(suggestion_cache):
+    app.cache_suggestion(cache_key("Safeway #1234"), "Food & Groceries")
+    forget_in_memory_cache()
+
+    # Store numbers and punctuation are normalized away
+    assert app.get_cached_suggestion(cache_key("SAFEWAY #987")) == "Food & Groceries"
+    assert app.get_cached_suggestion(cache_key("Shell")) is None
+
+
+def test_new_category_list_drops_older_suggestions(suggestion_cache):
+    new_categories = CATEGORIES + ["Coffee"]
+    app.cache_suggestion(cache_key("Safeway"), "Food & Groceries")
+    app.cache_suggestion(cache_key("Shell"), "Transportation")
+    forget_in_memory_cache()
+    app.cache_suggestion(cache_key("Starbucks", new_categories), "Coffee")
+    forget_in_memory_cache()
+
+    assert app.get_cached_suggestion(cache_key("Safeway")) is None
+    assert app.get_cached_suggestion(cache_key("Starbucks", new_categories)) == (
+        "Coffee"
+    )
+    conn = app._open_suggestion_db()
+    assert conn.execute("SELECT COUNT(*) FROM suggestions").fetchone() == (1,)
+
+
+def test_cache_file_keeps_most_recent_rows(suggestion_cache, monkeypatch):
+    monkeypatch.setattr(app, "LLM_CACHE_MAX_ROWS", 3)
+    for description in ["Alpha", "Bravo", "Charlie", "Delta"]:
+        app.cache_suggestion(cache_key(description), "Other")
+    # Rewriting a row makes it the most recent
+    app.cache_suggestion(cache_key("Bravo"), "Transportation")
+    app.cache_suggestion(cache_key("Echo"), "Other")
+    forget_in_memory_cache()
+
+    cached = {
+        description: app.get_cached_suggestion(cache_key(description))
+        for description in ["Alpha", "Bravo", "Charlie", "Delta", "Echo"]
+    }
+    assert cached == {
+        "Alpha": None,
+        "Bravo": "Transportation",
+        "Charlie": None,
+        "Delta": "Other",
+        "Echo": "Other",
+    }
+
+
+def test_map_row_replaces_cached_suggestion(client, ollama):
+    upload_csv(client, "Date,Amount,Description\n1/1/2024,-1,Shell\n")
+    transaction = {"Date": "1/2/2024", "Amount": "-2", "Description": "Shell #12"}
+
+    def suggest():
+        response = client.post(
+            "/api/suggest-category", json={"transaction_data": transaction}
+        )
+        assert response.status_code == 200
+        return response.get_json()["suggestion"]
+
+    assert suggest() == "Other"
+    response = client.post(
+        "/api/map-row", json={"row_index": 0, "category": "Transportation"}
+    )
+    assert response.status_code == 200
+
+    assert suggest() == "Transportation"
+    # Only the first suggestion needed the LLM
+    assert len(ollama.requests) == 1
+
+
+# --- Bulk suggestions ---
+
+
+def progress_rows(descriptions):
+    """Unmapped progress rows, one per description"""
+    return [
+        {
+            "data": {"Date": "01/02/2024", "Amount": "-1.00", "Description": d},
+            "category": None,
+            "mapped": False,
+        }
+        for d in descriptions
+    ]
+
+
+def test_bulk_suggestions_send_each_merchant_once(ollama, suggestion_cache):
+    rows = progress_rows(["Shell #1", "Safeway", "SHELL #2", "Costco", "Shell"])
+    app.cache_suggestion(cache_key("Costco"), "Food & Groceries")
+    answers = {0: "Transportation", 1: "Food & Groceries"}
+    ollama.reply = lambda batch: {
+        "mappings": [{"row": row, "category": answers[row]} for row in batch]
+    }
+
+    yielded = list(app.iter_bulk_suggestions(rows, range(5), CATEGORIES))
+
+    # The cached merchant comes first, then one batch with each new merchant
+    assert ollama.batches == [[0, 1]]
+    assert [sorted(mappings) for mappings in yielded] == [[3], [0, 1, 2, 4]]
+    suggestions = {
+        idx: m["suggestion"] for mappings in yielded for idx, m in mappings.items()
+    }
+    assert suggestions == {
+        0: "Transportation",
+        1: "Food & Groceries",
+        2: "Transportation",
+        3: "Food & Groceries",
+        4: "Transportation",
+    }
+
+
+# --- Month keys ---
+
+
+def strptime_month_key(date_str):
+    """Month key via the format list and split fallback, without the fast path"""
+    for fmt in app.ANALYTICS_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt).strftime("%Y-%m")
+        except ValueError:
+            continue
+    date_parts = date_str.split("/")
+    if len(date_parts) != 3:
+        return None
+    month, _day, year = date_parts
+    if len(year) == 2:
+        year = "20" + year
+    return f"{year}-{month:0>2}"
+
+
+def test_month_key_for_date_matches_strptime_path():
+    rng = random.Random(0)
+    dates = [
+        "01/02/2024",
+        "12/31/1999",
+        "1/2/24",
+        "2024-03-04",
+        "30-12-2024",
+        "Dec 30, 2024",
+        "December 30, 2024",
+        "13/01/2024",
+        "02/30/2024",
+        "00/05/2024",
+        "01/02/0001",
+        " 1/02/2024",
+        "01/0//2024",
+        "ab/cd/efgh",
+        "",
+        "garbage",
+    ]
+    for _ in range(20000):
+        dates.append(
+            "%02d/%02d/%04d"
+            % (rng.randint(0, 14), rng.randint(0, 33), rng.randint(1, 3000))
+        )
+        dates.append("".join(rng.choice("0123456789/ ab-") for _ in range(10)))
+
+    month_key = app.month_key_for_date.__wrapped__
+    for date_str in dates:
+        assert month_key(date_str) == strptime_month_key(date_str), date_str
+
+
+# --- Streamed bulk map ---
+
+
+def stream_lines(client):
+    response = client.post("/api/bulk-map/stream")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [orjson.loads(line) for line in response.data.splitlines()]
+
+
+def test_bulk_map_stream_sends_a_line_per_batch(client, ollama, monkeypatch):
+    monkeypatch.setattr(app, "LLM_BATCH_SIZE", 2)
+    monkeypatch.setattr(app, "OLLAMA_MAX_PARALLEL", 1)
+    upload_csv(
+        client,
+        "Date,Amount,Description\n"
+        + "".join(f"1/{day}/2024,-1,Store {chr(64 + day)}\n" for day in range(1, 6)),
+    )
+
+    lines = stream_lines(client)
+
+    assert [sorted(line["mappings"]) for line in lines] == [
+        ["0", "1"],
+        ["2", "3"],
+        ["4"],
+    ]
+    assert [line["progress"] for line in lines] == [
+        {"current": 2, "total": 5},
+        {"current": 4, "total": 5},
+        {"current": 5, "total": 5},
+    ]
+    assert lines[0]["mappings"]["0"]["suggestion"] == "Other"
+
+
+def test_bulk_map_stream_with_nothing_unmapped_sends_one_line(client):
+    upload_csv(client, "Date,Amount,Description\n1/1/2024,-1,A\n")
+    client.post("/api/map-row", json={"row_index": 0, "category": "Other"})
+
+    assert stream_lines(client) == [
+        {"mappings": {}, "progress": {"current": 0, "total": 0}}
+    ]
+
+
+def test_bulk_map_stream_reports_errors_on_a_final_line(client, monkeypatch):
+    def failing_suggestions(*args):
+        yield {}
+        raise RuntimeError("Ollama went away")
+
+    monkeypatch.setattr(app, "iter_bulk_suggestions", failing_suggestions)
+    upload_csv(client, "Date,Amount,Description\n1/1/2024,-1,A\n")
+
+    lines = stream_lines(client)
+
+    assert len(lines) == 2
+    assert lines[-1] == {"success": False, "error": "Server error: Ollama went away"}
+
+
+def test_bulk_map_stream_without_categories(client, monkeypatch):
+    monkeypatch.setattr(app, "load_categories", lambda: [])
+
+    response = client.post("/api/bulk-map/stream")
+
+    assert response.status_code == 400
+    assert response.get_json() == {
+        "success": False,
+        "error": "No categories available",
+    }
+
+
+# --- Conditional GETs ---
+
+
+@pytest.mark.parametrize("encoding", ["identity", "br", "gzip"])
+def test_progress_revalidates_with_compressed_etag(client, monkeypatch, encoding):
+    upload_csv(
+        client,
+        "Date,Amount,Description\n"
+        + "".join(f"1/2/2024,-1,Merchant {idx}\n" for idx in range(50)),
+    )
+    headers = {"Accept-Encoding": encoding}
+    # Flask-Compress turns a matching response into a 304 too, so record
+    # whether the view answered it before building the body
+    answered = []
+    not_modified = app._not_modified
+
+    def recording_not_modified(etag):
+        answered.append(not_modified(etag))
+        return answered[-1]
+
+    monkeypatch.setattr(app, "_not_modified", recording_not_modified)
+
+    response = client.get("/api/progress", headers=headers)
+    assert response.status_code == 200
+    etag = response.get_etag()[0]
+    if encoding != "identity":
+        # Flask-Compress tags compressed bodies with their encoding
+        assert response.headers["Content-Encoding"] == encoding
+        assert etag.endswith(f":{encoding}")
+
+    response = client.get(
+        "/api/progress", headers={**headers, "If-None-Match": f'"{etag}"'}
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+    assert answered[-1] is not None
+
+    # Mapping a row changes the ETag
+    client.post("/api/map-row", json={"row_index": 0, "category": "Other"})
+    response = client.get(
+        "/api/progress", headers={**headers, "If-None-Match": f'"{etag}"'}
+    )
+    assert response.status_code == 200
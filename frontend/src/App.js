@@ -6,9 +6,28 @@ import MappingInterface from './components/MappingInterface';
 import Stats from './components/Stats';
 import Analytics from './components/Analytics';
 import config from './config';
+import readNdjson from './ndjson';
 
 const API_BASE_URL = config.API_BASE_URL;
 
+// Read progress from the NDJSON stream endpoint: the first line is the
+// progress metadata and every following line is one row
+const fetchProgressStream = async () => {
+  const res = await fetch(`${API_BASE_URL}/progress/stream`);
+  let meta = null;
+  const rows = [];
+
+  await readNdjson(res, (value) => {
+    if (meta === null) {
+      meta = value;
+    } else {
+      rows.push(value);
+    }
+  });
+
+  return { ...meta, rows };
+};
+
 function App() {
   const [progress, setProgress] = useState(null);
   const [categories, setCategories] = useState([]);
@@ -73,7 +92,8 @@ function App() {
       const formData = new FormData();
       formData.append('file', file);
       const res = await axios.post(`${API_BASE_URL}/upload`, formData);
-      setProgress(res.data.progress);
+      // The upload response only carries a summary - stream in the parsed rows
+      setProgress(await fetchProgressStream());
       setError(null);
 
       // Display info message if provided
@@ -96,11 +116,17 @@ function App() {
 
   const handleMapRow = async (rowIndex, category) => {
     try {
-      const res = await axios.post(`${API_BASE_URL}/map-row`, {
+      await axios.post(`${API_BASE_URL}/map-row`, {
         row_index: rowIndex,
         category: category
       });
-      setProgress(res.data.progress);
+      // Patch the mapped row locally instead of reloading all progress
+      setProgress(prev => ({
+        ...prev,
+        rows: prev.rows.map((row, index) =>
+          index === rowIndex ? { ...row, category: category, mapped: true } : row
+        )
+      }));
       setError(null);
     } catch (err) {
       setError('Failed to map row: ' + err.message);
@@ -1,8 +1,8 @@
 import React, { useState, useMemo } from 'react';
-import axios from 'axios';
 import './MappingInterface.css';
 import ReviewScreen from './ReviewScreen';
 import config from '../config';
+import readNdjson from '../ndjson';
 
 const API_BASE_URL = config.API_BASE_URL;
 
@@ -21,10 +21,11 @@ function MappingInterface({ progress, categories, onMapRow, onAddCategory, onCon
 
   const rows = useMemo(() => {
     if (!progress.rows) return [];
-    return Object.entries(progress.rows).map(([idx, data]) => ({
-      index: parseInt(idx),
+    // Rows arrive as an array ordered by row index
+    return progress.rows.map((data, index) => ({
+      index,
       ...data
-    })).sort((a, b) => a.index - b.index);
+    }));
   }, [progress.rows]);
 
   const unmappedRows = rows.filter(row => !row.mapped);
@@ -121,23 +122,38 @@ function MappingInterface({ progress, categories, onMapRow, onAddCategory, onCon
       setBulkMappingError(null);
       setProcessingProgress({ current: 0, total: unmappedRows.length });
 
-      const res = await axios.post(`${API_BASE_URL}/bulk-map`, {}, {
-        timeout: 900000 // 15 minute timeout for bulk processing
-      });
+      // Suggestions stream in one batch per line, so the progress bar
+      // follows the batches as they finish
+      const res = await fetch(`${API_BASE_URL}/bulk-map/stream`, { method: 'POST' });
+      if (!res.ok && res.headers.get('Content-Type')?.includes('application/json')) {
+        const data = await res.json();
+        setBulkMappingError(data.error || 'Failed to generate bulk mappings');
+        return;
+      }
 
-      if (res.data.success) {
-        setBulkMappings(res.data.mappings);
+      const mappings = {};
+      let streamError = null;
+      await readNdjson(res, (value) => {
+        if (value.error) {
+          streamError = value.error;
+          return;
+        }
+        Object.assign(mappings, value.mappings);
         setProcessingProgress({
-          current: res.data.progress?.total || unmappedRows.length,
-          total: unmappedRows.length
+          current: value.progress.current,
+          total: value.progress.total
         });
-        setShowReviewScreen(true);
+      });
+
+      if (streamError) {
+        setBulkMappingError(streamError);
       } else {
-        setBulkMappingError(res.data.error || 'Failed to generate bulk mappings');
+        setBulkMappings(mappings);
+        setShowReviewScreen(true);
       }
     } catch (err) {
       console.error('Bulk map error:', err);
-      setBulkMappingError('Error: ' + (err.response?.data?.error || err.message));
+      setBulkMappingError('Error: ' + err.message);
     } finally {
       setIsProcessing(false);
       setTimeout(() => setProcessingProgress(null), 1000); // Keep showing 100% for a moment
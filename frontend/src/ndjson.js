@@ -0,0 +1,28 @@
+// Read a fetch() response body as newline-delimited JSON, calling onValue
+// with each parsed line as soon as it arrives
+const readNdjson = async (res, onValue) => {
+  if (!res.ok) {
+    throw new Error(`Request failed with status code ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+
+  const handleLine = (line) => {
+    if (!line) return;
+    onValue(JSON.parse(line));
+  };
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffered + decoder.decode());
+};
+
+export default readNdjson;
@@ -21,6 +21,10 @@ fi
 echo "✓ Docker and Docker Compose are installed"
 echo ""
 
+# docker-compose bind-mounts these state files. Create any that don't exist
+# yet, or Docker creates directories in their place
+touch "$(dirname "$0")/mapping_progress.log" "$(dirname "$0")/llm_cache.db"
+
 # Start Docker Compose
 echo "📦 Building and starting services..."
 docker-compose up --build
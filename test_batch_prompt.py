@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 """
 Test script to demonstrate batch categorization prompt.
-Shows how the LLM would process 5 transactions at once.
+Shows the messages and response schema the backend sends to Ollama
+for a batch of 5 transactions.
 """
 
+import json
+import sys
+from pathlib import Path
+
+# Use the backend's own prompt builders, so this shows what the app sends
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+from app import batch_response_format, build_batch_llm_prompt  # noqa: E402
+
 # Sample batch of 5 transactions
 transaction_batch = [
     (0, {
@@ -80,83 +89,50 @@ previous_mappings = [
 ]
 
 
-def build_batch_llm_prompt(transaction_batch, categories, previous_mappings):
-    """Build a prompt for batch categorization (up to 5 transactions at a time)."""
-
-    # Build examples from previous mappings
-    examples = ""
-    if previous_mappings:
-        examples = "\nHere are examples of previous categorizations:\n"
-        for mapping in previous_mappings[-100:]:
-            date = mapping.get('date', 'N/A')
-            amount = mapping.get('amount', 'N/A')
-            description = mapping.get('description', '')
-            category = mapping.get('category', 'N/A')
-            examples += f"- Date: {date} | Amount: {amount} | Description: \"{description}\" → {category}\n"
-
-    # Build categories list
-    categories_str = ", ".join(categories)
-
-    # Build transactions list with row indices
-    transactions_str = ""
-    for idx, transaction_data in transaction_batch:
-        date = transaction_data.get('Date', transaction_data.get('Transaction Date', 'N/A'))
-        amount = transaction_data.get('Amount', 'N/A')
-        description = transaction_data.get('Description', 'N/A')
-        transactions_str += f"Row {idx}: Date: {date} | Amount: {amount} | Description: \"{description}\"\n"
-
-    # Build the full prompt for batch processing
-    prompt = f"""You are a budget categorization assistant. Based on transaction details, suggest the most appropriate budget category for each transaction.
-
-Available Categories: {categories_str}
-
-{examples}
-
-Transactions to Categorize (batch processing):
-{transactions_str}
-
-For each transaction above, provide the category in the following format:
-Row {transaction_batch[0][0]}: <CATEGORY_NAME>
-Row {transaction_batch[1][0]}: <CATEGORY_NAME>
-...(continue for each row)
-
-Rules:
-- Respond with ONLY the row and category mapping
-- Do not include any explanation
-- Each line must be in the format: Row <number>: <CATEGORY_NAME>
-- Use the exact category names from the available list
-- Process all transactions
-
-Categories: """
-
-    return prompt
-
-
 if __name__ == "__main__":
+    system_prompt, user_prompt = build_batch_llm_prompt(
+        transaction_batch, categories, previous_mappings
+    )
+
     print("=" * 80)
     print("BATCH CATEGORIZATION PROMPT EXAMPLE")
     print("=" * 80)
     print()
-
-    prompt = build_batch_llm_prompt(transaction_batch, categories, previous_mappings)
-
-    print(prompt)
+    print("--- System message (same for every batch) ---")
+    print(system_prompt)
+    print()
+    print("--- User message (this batch) ---")
+    print(user_prompt)
+    print()
+    print("=" * 80)
+    print("RESPONSE SCHEMA (sent as Ollama's \"format\"):")
+    print("=" * 80)
+    print(json.dumps(batch_response_format(categories), indent=2))
     print()
     print("=" * 80)
     print("EXPECTED LLM RESPONSE FORMAT:")
     print("=" * 80)
-    print("Row 0: Healthcare")
-    print("Row 1: Food & Groceries")
-    print("Row 2: Transportation")
-    print("Row 3: Subscriptions")
-    print("Row 4: Transportation")
+    print(
+        json.dumps(
+            {
+                "mappings": [
+                    {"row": 0, "category": "Healthcare"},
+                    {"row": 1, "category": "Food & Groceries"},
+                    {"row": 2, "category": "Transportation"},
+                    {"row": 3, "category": "Subscriptions"},
+                    {"row": 4, "category": "Transportation"},
+                ]
+            },
+            indent=2,
+        )
+    )
     print()
     print("=" * 80)
     print("KEY FEATURES:")
     print("=" * 80)
-    print("✓ Processes 5 transactions in a single LLM call")
-    print("✓ Uses structured 'Row <idx>: <CATEGORY>' output format")
+    print("✓ Processes the whole batch in a single LLM call")
+    print("✓ Categories and examples form a system message Ollama can reuse")
+    print("✓ JSON output constrained to the available categories by the schema")
     print("✓ Includes up to 100 previous examples for context")
     print("✓ Validates categories against available list")
-    print("✓ Can be extended for remaining rows if less than 5")
     print("✓ Much faster than 5 separate API calls")